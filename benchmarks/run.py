@@ -0,0 +1,384 @@
+"""
+Load benchmark for the stream, home, detail and ad-tracking endpoints.
+
+Boots the app in-process against a freshly seeded SQLite database and media
+directory, drives each scenario from concurrent threads through Django's
+test client and prints throughput, latency percentiles and query counts as
+JSON so runs can be compared between commits. Per-view query counts, SQL
+time and repeated query shapes come from QueryBudgetMiddleware's samples:
+
+    python -m benchmarks.run --concurrency 8 --requests 500 --output before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+
+SEARCH_TERMS = ['cooking', 'travel', 'guitar', 'python', 'review', 'vlog']
+TITLE_WORDS = SEARCH_TERMS + ['daily', 'weekend', 'tutorial', 'highlights', 'live', 'music']
+# Ad events per request in the track_ad_batch scenario
+AD_BATCH_SIZE = 20
+NEXT_CURSOR_RE = re.compile(r'href="\?cursor=([^"&]+)[^"]*">\s*Older')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenarios', default='stream,home,detail,track_ad',
+                        help='Comma-separated scenarios to run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=400, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--videos', type=int, default=60, help='Videos to seed')
+    parser.add_argument('--video-size', type=float, default=4, help='Size of each seeded video in MB')
+    parser.add_argument('--range-size', type=int, default=1024 * 1024,
+                        help='Bytes a player fetches per range request')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark database and media')
+    return parser.parse_args(argv)
+
+
+def setup_django(directory):
+    os.environ['BENCHMARK_DIR'] = directory
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from videos import monetization_models
+
+    call_command('migrate', verbosity=0)
+    # The monetization tables were dropped from the migrations; create them directly
+    with connection.schema_editor() as editor:
+        for model in (
+            monetization_models.AdCampaign, monetization_models.Ad, monetization_models.VideoAd,
+            monetization_models.AdView, monetization_models.SubscriptionPlan,
+            monetization_models.UserSubscription, monetization_models.Payment,
+            monetization_models.Revenue, monetization_models.CreatorEarnings, monetization_models.Tip,
+        ):
+            editor.create_model(model)
+
+
+def seed(args, rng):
+    """Create users, videos with media files, and an ad campaign"""
+    from datetime import timedelta
+
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from videos import search
+    from videos.models import Video
+    from videos.monetization_models import Ad, AdCampaign
+
+    creators = [User.objects.create_user(f'creator{n}', password='bench') for n in range(10)]
+
+    video_dir = os.path.join(settings.MEDIA_ROOT, 'videos')
+    os.makedirs(video_dir, exist_ok=True)
+    size = int(args.video_size * 1024 * 1024)
+    now = timezone.now()
+    videos = []
+    for n in range(args.videos):
+        name = f'videos/bench-{n}.mp4'
+        with open(os.path.join(settings.MEDIA_ROOT, name), 'wb') as f:
+            f.write(rng.randbytes(size))
+        videos.append(Video(
+            title=' '.join(rng.sample(TITLE_WORDS, 3)).title(),
+            description=' '.join(rng.choices(TITLE_WORDS, k=20)),
+            video_file=name,
+            uploader=creators[n % len(creators)],
+            uploaded_at=now - timedelta(minutes=n),
+            is_public=n % 10 != 9,
+        ))
+    Video.objects.bulk_create(videos)
+    # bulk_create skips the post_save signal that indexes each video
+    search.rebuild_index()
+
+    campaign = AdCampaign.objects.create(
+        name='Benchmark campaign', advertiser='Benchmark', budget=1000,
+        end_date=now + timedelta(days=30),
+    )
+    ads = [
+        Ad.objects.create(campaign=campaign, title=f'Ad {n}', ad_type='video_pre',
+                          click_url='https://example.com/', duration=30)
+        for n in range(5)
+    ]
+    return {
+        'video_ids': list(Video.objects.filter(is_public=True).values_list('id', flat=True)),
+        'ad_ids': [ad.id for ad in ads],
+        'video_size': size,
+        'range_size': args.range_size,
+    }
+
+
+def _drain(response, limit=None):
+    """Read a response body, stopping after `limit` bytes like a player would"""
+    if not response.streaming:
+        return len(response.content)
+    received = 0
+    try:
+        for chunk in response.streaming_content:
+            received += len(chunk)
+            if limit is not None and received >= limit:
+                break
+    finally:
+        response.close()
+    return received
+
+
+class Playback:
+    """One simulated player: an open-ended first request, sequential ranges, occasional seeks"""
+
+    def __init__(self, data, rng):
+        self.data = data
+        self.rng = rng
+        self.video_id = None
+        self.position = 0
+
+    def __call__(self, client):
+        data, rng = self.data, self.rng
+        window = data['range_size']
+        if self.video_id is None or self.position >= data['video_size']:
+            self.video_id = rng.choice(data['video_ids'])
+            self.position = 0
+        elif rng.random() < 0.1:
+            self.position = rng.randrange(data['video_size'])
+
+        url = f'/stream/{self.video_id}/'
+        if self.position == 0:
+            # Browsers open with an open-ended range and drop the connection early
+            response = client.get(url, headers={'Range': 'bytes=0-'})
+            received = _drain(response, window)
+        else:
+            end = self.position + window - 1
+            response = client.get(url, headers={'Range': f'bytes={self.position}-{end}'})
+            received = _drain(response)
+        self.position += window
+        return response.status_code, received
+
+
+def home(data, rng):
+    cursor = None
+
+    def request(client):
+        # Scroll the feed by following its next-page cursor, with some searches mixed in
+        nonlocal cursor
+        if rng.random() < 0.3:
+            response = client.get('/', {'search': rng.choice(SEARCH_TERMS), 'page': rng.randint(1, 2)})
+            return response.status_code, _drain(response)
+        response = client.get('/', {'cursor': cursor} if cursor else {})
+        received = _drain(response)
+        match = NEXT_CURSOR_RE.search(response.content.decode())
+        cursor = unquote(match.group(1)) if match and rng.random() < 0.8 else None
+        return response.status_code, received
+    return request
+
+
+def detail(data, rng):
+    def request(client):
+        response = client.get(f'/video/{rng.choice(data["video_ids"])}/')
+        return response.status_code, _drain(response)
+    return request
+
+
+def track_ad(data, rng):
+    def request(client):
+        payload = {
+            'video_id': rng.choice(data['video_ids']),
+            'duration_watched': rng.randint(0, 30),
+            'was_clicked': rng.random() < 0.05,
+        }
+        response = client.post(f'/track-ad/{rng.choice(data["ad_ids"])}/', json.dumps(payload),
+                               content_type='application/json')
+        return response.status_code, _drain(response)
+    return request
+
+
+def track_ad_batch(data, rng):
+    def request(client):
+        events = [
+            {
+                'ad_id': rng.choice(data['ad_ids']),
+                'video_id': rng.choice(data['video_ids']),
+                'duration_watched': rng.randint(0, 30),
+                'was_clicked': rng.random() < 0.05,
+            }
+            for _ in range(AD_BATCH_SIZE)
+        ]
+        response = client.post('/track-ad/batch/', json.dumps({'events': events}),
+                               content_type='application/json')
+        return response.status_code, _drain(response)
+    return request
+
+
+SCENARIOS = {
+    'stream': Playback,
+    'home': home,
+    'detail': detail,
+    'track_ad': track_ad,
+    'track_ad_batch': track_ad_batch,
+}
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_scenario(name, data, args):
+    """Run one scenario from `concurrency` threads and summarise it"""
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from videos.query_budget import summarize_samples
+
+    total = args.warmup + args.requests
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker(worker_number):
+        rng = random.Random(f'{args.seed}-{name}-{worker_number}')
+        client = Client(raise_request_exception=False)
+        request = SCENARIOS[name](data, rng)
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        try:
+            while True:
+                with counter_lock:
+                    number = next(counter, None)
+                if number is None:
+                    return
+                queries.clear()
+                started = time.perf_counter()
+                with connection.execute_wrapper(count_queries):
+                    status, received = request(client)
+                elapsed = time.perf_counter() - started
+                if number >= args.warmup:
+                    with samples_lock:
+                        samples.append((elapsed, status, received, len(queries)))
+        finally:
+            connection.close()
+
+    sample_file = settings.VIDEO_QUERY_SAMPLE_FILE
+    sample_offset = os.path.getsize(sample_file) if os.path.exists(sample_file) else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    wall = time.perf_counter() - started
+    # Per-view query samples written by QueryBudgetMiddleware, warm-up included
+    views = {}
+    if os.path.exists(sample_file):
+        with open(sample_file) as f:
+            f.seek(sample_offset)
+            views = summarize_samples(f)
+
+    latencies = [sample[0] * 1000 for sample in samples]
+    query_counts = [sample[3] for sample in samples]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    errors = sum(count for status, count in statuses.items() if int(status) >= 400)
+    transferred = sum(sample[2] for sample in samples)
+    # Warm-up requests share the wall clock, so scale it to the measured share
+    measured_wall = wall * len(samples) / total if total else wall
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'statuses': statuses,
+        'throughput_rps': round(len(samples) / measured_wall, 2) if measured_wall else None,
+        'bytes': transferred,
+        'bytes_per_second': round(transferred / measured_wall) if measured_wall else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': round(_percentile(latencies, 50), 3) if latencies else None,
+            'p95': round(_percentile(latencies, 95), 3) if latencies else None,
+            'p99': round(_percentile(latencies, 99), 3) if latencies else None,
+            'max': round(max(latencies), 3) if latencies else None,
+        },
+        'queries': {
+            'mean': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+            'p95': _percentile(query_counts, 95),
+            'max': max(query_counts) if query_counts else None,
+        },
+        'views': views,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}. Choose from {', '.join(SCENARIOS)}")
+
+    directory = tempfile.mkdtemp(prefix='videostream-bench-')
+    try:
+        setup_django(directory)
+        import django
+        rng = random.Random(args.seed)
+        data = seed(args, rng)
+        report = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'config': {
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'warmup': args.warmup,
+                'videos': args.videos,
+                'video_size_mb': args.video_size,
+                'range_size': args.range_size,
+                'seed': args.seed,
+            },
+            'scenarios': {name: run_scenario(name, data, args) for name in names},
+        }
+        # Write buffered view counts while the database still exists
+        from videos.view_counter import view_counter
+        view_counter.stop()
+    finally:
+        if args.keep:
+            print(f'Benchmark data kept in {directory}', file=sys.stderr)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Settings for the load benchmark: the project settings pointed at a
+throwaway SQLite database and media directory
+"""
+
+import os
+
+from videostream.settings import *  # noqa: F401,F403
+
+BENCHMARK_DIR = os.environ['BENCHMARK_DIR']
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver', 'localhost', '127.0.0.1']
+ROOT_URLCONF = 'benchmarks.urls'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+        # Concurrent view increments and ad events queue on the write lock
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+
+# Static files aren't part of the benchmark and no collectstatic has run
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+MIDDLEWARE = [name for name in MIDDLEWARE if not name.startswith('whitenoise.')]  # noqa: F405
+
+# Every request's query count goes to the report's per-view summary
+VIDEO_QUERY_SAMPLE_FILE = os.path.join(BENCHMARK_DIR, 'queries.jsonl')
+VIDEO_QUERY_SAMPLE_RATE = 1.0
+VIDEO_QUERY_BUDGET_STRICT = False
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {
+        'django.request': {'level': 'CRITICAL'},
+    },
+}
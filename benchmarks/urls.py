@@ -0,0 +1,16 @@
+"""
+URLs for the load benchmark: the videos app plus the monetization routes
+that are still disabled in videos/urls.py
+"""
+
+from django.urls import include, path
+
+from videos import monetization_views
+
+urlpatterns = [
+    path('', include('videos.urls')),
+    path('accounts/', include('django.contrib.auth.urls')),
+    path('track-ad/batch/', monetization_views.track_ad_events, name='track_ad_events'),
+    path('track-ad/<int:ad_id>/', monetization_views.track_ad_view, name='track_ad_view'),
+    path('video/<int:video_id>/tip/', monetization_views.send_tip, name='send_tip'),
+]
@@ -1,14 +1,24 @@
 from django.contrib import admin
-from .models import Video, Comment
+from . import jobs
+from .models import Video, Comment, Job, VideoRendition
+
+
+class VideoRenditionInline(admin.TabularInline):
+    model = VideoRendition
+    extra = 0
+    readonly_fields = ['name', 'width', 'height', 'video_bitrate', 'status', 'error', 'updated_at']
+    can_delete = False
 
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ['title', 'uploader', 'views', 'uploaded_at', 'is_public']
-    list_filter = ['is_public', 'uploaded_at', 'uploader']
+    list_display = ['title', 'uploader', 'views', 'uploaded_at', 'is_public', 'processing_status']
+    list_filter = ['is_public', 'processing_status', 'uploaded_at', 'uploader']
     search_fields = ['title', 'description', 'uploader__username']
-    readonly_fields = ['views', 'uploaded_at']
+    readonly_fields = ['views', 'uploaded_at', 'file_size', 'duration', 'bitrate', 'width', 'height',
+                       'video_codec', 'audio_codec']
     ordering = ['-uploaded_at']
+    inlines = [VideoRenditionInline]
 
 
 @admin.register(Comment)
@@ -17,3 +27,18 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
     search_fields = ['user__username', 'content', 'video__title']
     ordering = ['-created_at']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'args', 'status', 'priority', 'attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    search_fields = ['name', 'idempotency_key']
+    readonly_fields = ['locked_by', 'locked_until', 'error', 'created_at', 'finished_at']
+    ordering = ['-created_at']
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected failed jobs')
+    def retry_jobs(self, request, queryset):
+        count = jobs.retry(queryset)
+        self.message_user(request, f'Queued {count} jobs again.')
@@ -0,0 +1,209 @@
+"""
+Poster, card thumbnails and seek-preview sprites for videos
+"""
+
+import hashlib
+import io
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+import ffmpeg
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from . import page_cache
+
+logger = logging.getLogger(__name__)
+
+JPEG_OPTIONS = {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}
+WEBP_OPTIONS = {'format': 'WEBP', 'quality': 80, 'method': 4}
+CARD_ASPECT = 9 / 16
+
+
+def generate_artwork(video):
+    """Build a video's poster, card thumbnails and seek-preview sprite.
+
+    The poster comes from the uploaded thumbnail or, without one, from a
+    frame VIDEO_POSTER_POSITION of the way into the video. Every file is
+    written to MEDIA_ROOT/artwork/<video id>/ under a name containing a
+    hash of its content, so it can be cached forever; files of an earlier
+    run are removed once Video.artwork points at the new ones.
+    """
+    output_dir = os.path.join(settings.MEDIA_ROOT, video.artwork_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    duration = video.duration or _duration(video)
+
+    artwork = {}
+    try:
+        poster = _poster_image(video, duration)
+    except (ffmpeg.Error, OSError, ValueError) as exc:
+        logger.error('Cannot extract a poster for video %s: %s', video.id, _error_text(exc))
+        poster = None
+    if poster is not None:
+        artwork['poster'] = _write_image(output_dir, 'poster', _fit_width(poster, settings.VIDEO_POSTER_WIDTH), JPEG_OPTIONS)
+        artwork['thumbnails'] = _write_thumbnails(output_dir, poster)
+
+    if duration:
+        try:
+            artwork['sprite'] = _write_sprite(video, output_dir, duration)
+        except (ffmpeg.Error, OSError, ValueError) as exc:
+            logger.error('Cannot build the preview sprite of video %s: %s', video.id, _error_text(exc))
+
+    video.artwork = artwork
+    video.save(update_fields=['artwork'])
+    _remove_stale(output_dir, artwork)
+    page_cache.invalidate_video(video.id)
+    return artwork
+
+
+def _duration(video):
+    """Length of the video in seconds, or None if ffprobe can't tell"""
+    try:
+        return float(ffmpeg.probe(video.video_file.path)['format']['duration'])
+    except (ffmpeg.Error, OSError, KeyError, ValueError) as exc:
+        logger.warning('Cannot read the duration of video %s: %s', video.id, _error_text(exc))
+        return None
+
+
+def _poster_image(video, duration):
+    """RGB poster image: the uploaded thumbnail, else an extracted frame"""
+    if video.thumbnail:
+        with video.thumbnail.open('rb') as f:
+            image = Image.open(f)
+            image.load()
+        return ImageOps.exif_transpose(image).convert('RGB')
+
+    position = (duration or 0) * settings.VIDEO_POSTER_POSITION
+    frame, _ = (
+        ffmpeg
+        .input(video.video_file.path, ss=f'{position:.3f}')
+        .output('pipe:', vframes=1, format='image2', vcodec='mjpeg')
+        .run(capture_stdout=True, quiet=True)
+    )
+    if not frame:
+        raise ValueError('ffmpeg returned no frame')
+    return Image.open(io.BytesIO(frame)).convert('RGB')
+
+
+def _write_thumbnails(output_dir, poster):
+    """WebP and JPEG crops of the poster at each card width"""
+    thumbnails = []
+    for width in sorted(settings.VIDEO_THUMBNAIL_WIDTHS):
+        height = round(width * CARD_ASPECT)
+        image = ImageOps.fit(poster, (width, height), Image.LANCZOS)
+        thumbnails.append({
+            'width': width,
+            'height': height,
+            'webp': _write_image(output_dir, f'thumb-{width}', image, WEBP_OPTIONS),
+            'jpeg': _write_image(output_dir, f'thumb-{width}', image, JPEG_OPTIONS),
+        })
+    return thumbnails
+
+
+def _write_sprite(video, output_dir, duration):
+    """Tile frames taken every few seconds into one JPEG, indexed by a WebVTT file"""
+    interval = max(settings.VIDEO_SPRITE_INTERVAL, duration / settings.VIDEO_SPRITE_MAX_TILES)
+    tile_width = settings.VIDEO_SPRITE_TILE_WIDTH
+    frame_dir = tempfile.mkdtemp(prefix='sprite-')
+    try:
+        (
+            ffmpeg
+            .input(video.video_file.path)
+            .output(
+                os.path.join(frame_dir, '%05d.jpg'),
+                vf=f'fps=1/{interval:.3f},scale={tile_width}:-2',
+                vframes=math.ceil(duration / interval),
+                **{'q:v': 5}
+            )
+            .run(quiet=True)
+        )
+        frames = []
+        for name in sorted(os.listdir(frame_dir)):
+            with Image.open(os.path.join(frame_dir, name)) as frame:
+                frames.append(frame.convert('RGB'))
+    finally:
+        shutil.rmtree(frame_dir, ignore_errors=True)
+    if not frames:
+        raise ValueError('ffmpeg returned no frames')
+
+    tile_height = frames[0].height
+    columns = min(settings.VIDEO_SPRITE_COLUMNS, len(frames))
+    rows = math.ceil(len(frames) / columns)
+    sprite = Image.new('RGB', (columns * tile_width, rows * tile_height))
+    cues = ['WEBVTT', '']
+    for index, frame in enumerate(frames):
+        x, y = index % columns * tile_width, index // columns * tile_height
+        sprite.paste(frame, (x, y))
+        start, end = index * interval, min((index + 1) * interval, duration)
+        cues.append(f'{_timestamp(start)} --> {_timestamp(end)}')
+        cues.append(f'{{image}}#xywh={x},{y},{tile_width},{tile_height}')
+        cues.append('')
+    image_name = _write_image(output_dir, 'sprite', sprite, JPEG_OPTIONS)
+    # Cue URLs are relative to the VTT file, which sits next to the image
+    vtt = '\n'.join(cues).replace('{image}', image_name).encode()
+    return {
+        'image': image_name,
+        'vtt': _write_file(output_dir, 'sprite', 'vtt', vtt),
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+    }
+
+
+def _fit_width(image, width):
+    """`image` scaled down to at most `width` pixels wide"""
+    if image.width <= width:
+        return image
+    return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+
+def _write_image(output_dir, stem, image, options):
+    buffer = io.BytesIO()
+    image.save(buffer, **options)
+    extension = 'jpg' if options['format'] == 'JPEG' else options['format'].lower()
+    return _write_file(output_dir, stem, extension, buffer.getvalue())
+
+
+def _write_file(output_dir, stem, extension, data):
+    """Write `data` as <stem>-<content hash>.<extension>; returns the file name"""
+    name = f'{stem}-{hashlib.sha256(data).hexdigest()[:16]}.{extension}'
+    path = os.path.join(output_dir, name)
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return name
+
+
+def _remove_stale(output_dir, artwork):
+    """Delete files in the artwork directory that `artwork` no longer names"""
+    keep = {artwork.get('poster')}
+    for thumbnail in artwork.get('thumbnails', []):
+        keep.update((thumbnail['webp'], thumbnail['jpeg']))
+    sprite = artwork.get('sprite')
+    if sprite:
+        keep.update((sprite['image'], sprite['vtt']))
+    for name in os.listdir(output_dir):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError:
+                pass
+
+
+def _timestamp(seconds):
+    """WebVTT timestamp, hh:mm:ss.mmm"""
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    return f'{hours:02d}:{minutes:02d}:{milliseconds // 1000:02d}.{milliseconds % 1000:03d}'
+
+
+def _error_text(exc):
+    stderr = getattr(exc, 'stderr', None)
+    if stderr:
+        return stderr.decode('utf-8', 'replace')[-2000:]
+    return str(exc)
@@ -0,0 +1,43 @@
+"""
+Reference counts of the stored media files that model fields point at
+"""
+
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from . import jobs
+from .models import MediaBlob
+from .storage import media_storage
+
+
+def retain(names):
+    """Count a new reference to each file name"""
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, size=_size(name)) for name in counts], ignore_conflicts=True
+    )
+    for name, amount in counts.items():
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + amount)
+
+
+def release(names):
+    """Drop a reference to each file name; files left unreferenced are deleted by a job"""
+    counts = Counter(name for name in names if name)
+    for name, amount in counts.items():
+        MediaBlob.objects.filter(name=name).update(refcount=Greatest(F('refcount') - amount, 0))
+    if counts:
+        # The job rechecks the counts, so a file uploaded again meanwhile is kept
+        jobs.enqueue('delete_media', list(counts), delay=settings.VIDEO_MEDIA_DELETE_DELAY)
+
+
+def _size(name):
+    try:
+        return os.path.getsize(media_storage.path(name))
+    except OSError:
+        return 0
@@ -0,0 +1,172 @@
+"""
+In-memory cache of hot byte ranges of popular video files
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class BlockCache:
+    """Bounded, size-aware LRU of aligned file blocks.
+
+    Files are cached in VIDEO_BLOCK_CACHE_BLOCK_SIZE blocks keyed on
+    (path, size, mtime, block number), so a replaced file never serves stale
+    bytes. A file only becomes eligible once it has been requested
+    VIDEO_BLOCK_CACHE_ADMIT_AFTER times (a small LFU admission filter), which
+    keeps one-off playbacks from flushing the blocks of trending videos.
+    Ranges are served from memory when every block they cover is cached or
+    can be loaded with a bounded number of reads; longer ones can still take
+    their leading blocks from memory.
+    """
+
+    def __init__(self):
+        self._blocks = OrderedDict()
+        self._keys_by_path = {}
+        self._popularity = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return settings.VIDEO_BLOCK_CACHE_SIZE > 0
+
+    def get_range(self, meta, offset, length, load=True, partial=False):
+        """Return the bytes of [offset, offset + length) as a list of memoryviews.
+
+        Returns None when the range can't be served from memory: the cache is
+        off, the file isn't popular yet, or the range needs too many blocks.
+        With load=False only blocks already in memory are used. With
+        partial=True a range that can't be served whole still gets its
+        leading blocks that are cached or loadable, so the caller only reads
+        the rest from the file; None then means not even the first block.
+        """
+        if not self.enabled or length <= 0:
+            return None
+
+        block_size = settings.VIDEO_BLOCK_CACHE_BLOCK_SIZE
+        first_block = offset // block_size
+        last_block = (offset + length - 1) // block_size
+        keys = [(meta.path, meta.size, meta.mtime, number) for number in range(first_block, last_block + 1)]
+
+        with self._lock:
+            blocks = [self._blocks.get(key) for key in keys]
+            hot = self._record_request(meta.path)
+            if partial and None in blocks:
+                # An open-ended range of a big file: keep the leading blocks
+                budget = settings.VIDEO_BLOCK_CACHE_MAX_LOAD_BLOCKS if load and hot else 0
+                count = 0
+                for block in blocks:
+                    if block is None:
+                        if not budget:
+                            break
+                        budget -= 1
+                    count += 1
+                keys, blocks = keys[:count], blocks[:count]
+            missing = [key for key, block in zip(keys, blocks) if block is None]
+            if not missing and len(keys) == last_block - first_block + 1:
+                for key in keys:
+                    self._blocks.move_to_end(key)
+                self.hits += 1
+            else:
+                if partial:
+                    for key, block in zip(keys, blocks):
+                        if block is not None:
+                            self._blocks.move_to_end(key)
+                self.misses += 1
+
+        if not keys:
+            return None
+        if missing:
+            if not load or not hot or len(missing) > settings.VIDEO_BLOCK_CACHE_MAX_LOAD_BLOCKS:
+                return None
+            loaded = self._load_blocks(meta.path, missing, block_size)
+            if loaded is None:
+                return None
+            blocks = [block if block is not None else loaded[key] for key, block in zip(keys, blocks)]
+
+        start = offset - first_block * block_size
+        end = start + length
+        chunks = []
+        position = 0
+        for block in blocks:
+            block_start, block_end = max(start - position, 0), min(end - position, len(block))
+            if block_start < block_end:
+                chunks.append(memoryview(block)[block_start:block_end])
+            position += len(block)
+        return chunks
+
+    def _record_request(self, path):
+        """Count a request for `path` and report whether it is hot. Needs the lock."""
+        count = self._popularity.pop(path, 0) + 1
+        self._popularity[path] = count
+        while len(self._popularity) > settings.VIDEO_BLOCK_CACHE_TRACKED_FILES:
+            self._popularity.popitem(last=False)
+        return count >= settings.VIDEO_BLOCK_CACHE_ADMIT_AFTER
+
+    def _load_blocks(self, path, keys, block_size):
+        """Read the given blocks from disk and add them to the cache"""
+        loaded = {}
+        try:
+            with open(path, 'rb') as f:
+                for key in keys:
+                    f.seek(key[3] * block_size)
+                    loaded[key] = f.read(block_size)
+        except OSError:
+            return None
+
+        with self._lock:
+            for key, block in loaded.items():
+                if key in self._blocks:
+                    continue
+                self._blocks[key] = block
+                self._keys_by_path.setdefault(path, set()).add(key)
+                self.current_bytes += len(block)
+            self._evict()
+        return loaded
+
+    def _evict(self):
+        """Drop least recently used blocks until under the size limit. Needs the lock."""
+        while self._blocks and self.current_bytes > settings.VIDEO_BLOCK_CACHE_SIZE:
+            key, block = self._blocks.popitem(last=False)
+            self._forget(key, block)
+            self.evictions += 1
+
+    def _forget(self, key, block):
+        self.current_bytes -= len(block)
+        path_keys = self._keys_by_path.get(key[0])
+        if path_keys is not None:
+            path_keys.discard(key)
+            if not path_keys:
+                del self._keys_by_path[key[0]]
+
+    def invalidate(self, path):
+        """Drop every cached block of a file, e.g. one a video no longer points at"""
+        with self._lock:
+            for key in list(self._keys_by_path.get(path, ())):
+                self._forget(key, self._blocks.pop(key))
+            self._popularity.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._keys_by_path.clear()
+            self._popularity.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'blocks': len(self._blocks),
+                'bytes': self.current_bytes,
+            }
+
+
+block_cache = BlockCache()
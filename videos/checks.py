@@ -0,0 +1,25 @@
+"""
+System checks for settings that only matter in production
+"""
+
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """State every worker must see can't live in a per-process cache"""
+    backend = settings.CACHES.get(settings.VIDEO_VIEW_DEDUPE_CACHE, {}).get('BACKEND')
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'The {settings.VIDEO_VIEW_DEDUPE_CACHE!r} cache ({backend}) is local to each process, so every '
+        'worker deduplicates views on its own.',
+        hint='Set SHARED_CACHE_BACKEND and SHARED_CACHE_LOCATION to a Redis or Memcached server.',
+        id='videos.W001',
+    )]
@@ -0,0 +1,24 @@
+"""
+Identify the client behind a reverse proxy
+"""
+
+from django.conf import settings
+
+
+def client_ip(request):
+    """The client's address, read from VIDEO_CLIENT_IP_HEADER when a trusted proxy forwarded the request.
+
+    Each proxy appends the address it received the request from, so the
+    client is the last entry that isn't one of VIDEO_TRUSTED_PROXIES;
+    entries before it may have been made up by the client.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    header = settings.VIDEO_CLIENT_IP_HEADER
+    trusted = settings.VIDEO_TRUSTED_PROXIES
+    if not header or address not in trusted:
+        return address
+    for hop in reversed(request.META.get(header, '').split(',')):
+        hop = hop.strip()
+        if hop and hop not in trusted:
+            return hop
+    return address
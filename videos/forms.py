@@ -1,7 +1,24 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
-from .models import Video, Comment
+from django.template.defaultfilters import filesizeformat
+from .models import Video, Comment, UploadSession
+
+ALLOWED_VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.wmv', '.mkv', '.webm']
+
+
+def validate_video_upload(name, size):
+    """Check an uploaded video's size and extension"""
+    if size > settings.VIDEO_MAX_UPLOAD_SIZE:
+        raise forms.ValidationError(
+            f"File size cannot exceed {filesizeformat(settings.VIDEO_MAX_UPLOAD_SIZE)}"
+        )
+    file_extension = name.lower().split('.')[-1]
+    if f'.{file_extension}' not in ALLOWED_VIDEO_EXTENSIONS:
+        raise forms.ValidationError(
+            f"Unsupported file format. Allowed formats: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}"
+        )
 
 
 class VideoUploadForm(forms.ModelForm):
@@ -34,21 +51,27 @@ class VideoUploadForm(forms.ModelForm):
     def clean_video_file(self):
         video_file = self.cleaned_data.get('video_file')
         if video_file:
-            # Check file size (100MB limit)
-            if video_file.size > 100 * 1024 * 1024:
-                raise forms.ValidationError("File size cannot exceed 100MB")
-            
-            # Check file extension
-            allowed_extensions = ['.mp4', '.avi', '.mov', '.wmv', '.mkv', '.webm']
-            file_extension = video_file.name.lower().split('.')[-1]
-            if f'.{file_extension}' not in allowed_extensions:
-                raise forms.ValidationError(
-                    f"Unsupported file format. Allowed formats: {', '.join(allowed_extensions)}"
-                )
+            validate_video_upload(video_file.name, video_file.size)
         
         return video_file
 
 
+class UploadSessionForm(forms.ModelForm):
+    """Details of a resumable upload, sent before its chunks"""
+    class Meta:
+        model = UploadSession
+        fields = ['filename', 'size', 'title', 'description', 'thumbnail', 'is_public']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        filename, size = cleaned_data.get('filename'), cleaned_data.get('size')
+        if filename and size is not None:
+            if size == 0:
+                raise forms.ValidationError("The video file is empty")
+            validate_video_upload(filename, size)
+        return cleaned_data
+
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
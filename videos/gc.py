@@ -0,0 +1,195 @@
+"""
+Find and reclaim media files that nothing references
+"""
+
+import os
+import shutil
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import MediaBlob, UploadSession, Video
+
+# Directories under MEDIA_ROOT holding files named by model fields
+FILE_ROOTS = ('blobs', 'videos', 'thumbnails')
+# Directories under MEDIA_ROOT holding one directory per video
+VIDEO_DIR_ROOTS = ('hls', 'artwork')
+
+# Names rechecked per query before deleting
+CHECK_BATCH = 500
+
+Orphan = namedtuple('Orphan', ['category', 'name', 'size'])
+
+
+def _media_path(name):
+    """Absolute path of `name`, refusing anything outside MEDIA_ROOT"""
+    root = os.path.abspath(settings.MEDIA_ROOT)
+    path = os.path.abspath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f'{name!r} is not inside MEDIA_ROOT')
+    return path
+
+
+def _scan(directory, cutoff, recursive=True):
+    """(name, size) of the files under `directory` last modified before `cutoff`"""
+    root = settings.MEDIA_ROOT
+    found = []
+    pending = [directory]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    pending.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < cutoff:
+                    found.append((os.path.relpath(entry.path, root), stat.st_size))
+    return found
+
+
+def _tree_size(path):
+    return sum(size for _, size in _scan(path, float('inf')))
+
+
+def _scan_units(cutoff):
+    """Independent scans covering the file roots, split by first-level directory"""
+    units = []
+    for root in FILE_ROOTS:
+        path = os.path.join(settings.MEDIA_ROOT, root)
+        units.append((path, cutoff, False))
+        try:
+            units.extend((entry.path, cutoff, True) for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False))
+        except FileNotFoundError:
+            pass
+    return units
+
+
+def referenced_names():
+    """Every media file name a model field or a counted MediaBlob points at"""
+    names = set(MediaBlob.objects.filter(refcount__gt=0).values_list('name', flat=True).iterator())
+    for video_file, thumbnail in Video.objects.values_list('video_file', 'thumbnail').iterator():
+        names.update((video_file, thumbnail))
+    names.update(UploadSession.objects.values_list('thumbnail', flat=True).iterator())
+    names.discard(None)
+    names.discard('')
+    return names
+
+
+def find_orphans(grace_hours=None, workers=None):
+    """List the media nothing references.
+
+    Covers files under blobs/ (including abandoned temporary files),
+    videos/ and thumbnails/, part files of uploads that no longer exist,
+    and the HLS and artwork directories of deleted videos. Only things
+    older than `grace_hours` are considered, so files that are being
+    written or whose row isn't committed yet are left alone. The file
+    roots are walked in parallel, one first-level directory per task.
+    """
+    grace_hours = settings.VIDEO_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    cutoff = time.time() - grace_hours * 60 * 60
+    # Read the references before listing files, so a file written after the
+    # query is younger than the cutoff rather than wrongly unreferenced
+    referenced = referenced_names()
+    video_ids = set(Video.objects.values_list('id', flat=True).iterator())
+    session_ids = {str(session_id) for session_id in UploadSession.objects.values_list('id', flat=True).iterator()}
+
+    orphans = []
+    with ThreadPoolExecutor(max_workers=workers or settings.VIDEO_GC_WORKERS) as executor:
+        for found in executor.map(lambda unit: _scan(*unit), _scan_units(cutoff)):
+            for name, size in found:
+                if name not in referenced:
+                    category = 'temporary' if name.startswith('blobs/tmp/') else name.split('/', 1)[0]
+                    orphans.append(Orphan(category, name, size))
+
+    upload_dir = os.path.join(settings.MEDIA_ROOT, settings.VIDEO_UPLOAD_DIR)
+    for name, size in _scan(upload_dir, cutoff, recursive=False):
+        stem, extension = os.path.splitext(os.path.basename(name))
+        if extension == '.part' and stem not in session_ids:
+            orphans.append(Orphan('uploads', name, size))
+
+    for root in VIDEO_DIR_ROOTS:
+        try:
+            entries = list(os.scandir(os.path.join(settings.MEDIA_ROOT, root)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if (entry.is_dir(follow_symlinks=False) and entry.name.isdigit() and int(entry.name) not in video_ids
+                    and entry.stat(follow_symlinks=False).st_mtime < cutoff):
+                orphans.append(Orphan(root, f'{root}/{entry.name}', _tree_size(entry.path)))
+    return orphans
+
+
+def _still_referenced(names):
+    """The subset of `names` that gained a reference since they were found"""
+    live = set()
+    for start in range(0, len(names), CHECK_BATCH):
+        batch = names[start:start + CHECK_BATCH]
+        live.update(MediaBlob.objects.filter(name__in=batch, refcount__gt=0).values_list('name', flat=True))
+        for video_file, thumbnail in Video.objects.filter(
+            Q(video_file__in=batch) | Q(thumbnail__in=batch)
+        ).values_list('video_file', 'thumbnail'):
+            live.update((video_file, thumbnail))
+        live.update(UploadSession.objects.filter(thumbnail__in=batch).values_list('thumbnail', flat=True))
+
+        video_ids, session_ids = {}, {}
+        for name in batch:
+            root, _, rest = name.partition('/')
+            if root in VIDEO_DIR_ROOTS and rest.isdigit():
+                video_ids[int(rest)] = name
+            elif root == settings.VIDEO_UPLOAD_DIR and rest.endswith('.part'):
+                session_ids[rest[:-len('.part')]] = name
+        live.update(video_ids[video_id] for video_id in Video.objects.filter(id__in=video_ids).values_list('id', flat=True))
+        existing = UploadSession.objects.filter(id__in=[key for key in session_ids if _is_uuid(key)])
+        live.update(session_ids[str(session_id)] for session_id in existing.values_list('id', flat=True))
+    return live
+
+
+def _is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def delete_media(names):
+    """Delete the files and per-video directories in `names` that are still unreferenced.
+
+    Everything is checked again first, since a video may have been
+    uploaded with identical content since the names were collected.
+    Returns (items deleted, bytes freed).
+    """
+    names = list(dict.fromkeys(names))
+    live = _still_referenced(names)
+    deleted, freed = [], 0
+    for name in names:
+        if name in live:
+            continue
+        path = _media_path(name)
+        try:
+            if os.path.isdir(path):
+                size = _tree_size(path)
+                shutil.rmtree(path)
+            else:
+                size = os.path.getsize(path)
+                os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        deleted.append(name)
+        freed += size
+    for start in range(0, len(deleted), CHECK_BATCH):
+        MediaBlob.objects.filter(name__in=deleted[start:start + CHECK_BATCH], refcount=0).delete()
+    return len(deleted), freed
+
+
+def collect(grace_hours=None, workers=None):
+    """Find the orphans and delete them; returns (items deleted, bytes freed)"""
+    return delete_media(orphan.name for orphan in find_orphans(grace_hours, workers))
@@ -0,0 +1,279 @@
+"""
+Durable background jobs stored in the database, run by `manage.py run_worker`
+"""
+
+import importlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Due jobs read per claim attempt; losing a race moves on to the next one
+CLAIM_BATCH = 10
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: Callable
+    priority: int
+    max_attempts: int
+    timeout: int
+    on_failure: Optional[Callable]
+
+
+tasks = {}
+
+# The job this worker process is running, for heartbeat()
+_leased = None
+
+
+def task(name, priority=0, max_attempts=None, timeout=None, on_failure=None):
+    """Register the decorated function as the task `name`.
+
+    Tasks can run more than once (retries, expired leases), so they must be
+    safe to repeat. `on_failure(*args)` is called when the last attempt fails.
+    """
+    def register(func):
+        tasks[name] = Task(
+            name=name,
+            func=func,
+            priority=priority,
+            max_attempts=max_attempts or settings.VIDEO_JOB_MAX_ATTEMPTS,
+            timeout=timeout or settings.VIDEO_JOB_VISIBILITY_TIMEOUT,
+            on_failure=on_failure,
+        )
+        return func
+    return register
+
+
+def load_tasks():
+    """Import the VIDEO_JOB_MODULES that register tasks"""
+    for module in settings.VIDEO_JOB_MODULES:
+        importlib.import_module(module)
+
+
+def get_task(name):
+    if name not in tasks:
+        load_tasks()
+    return tasks.get(name)
+
+
+def enqueue(name, *args, key=None, priority=None, delay=0):
+    """Queue the task `name` to run with `args` and return its Job.
+
+    The row is written in the caller's transaction, so the job exists
+    exactly when the work that asked for it was committed. With `key`,
+    enqueueing again returns the job already holding that key.
+    """
+    spec = get_task(name)
+    if spec is None:
+        raise LookupError(f'No task named {name!r}')
+    fields = {
+        'name': name,
+        'args': list(args),
+        'priority': spec.priority if priority is None else priority,
+        'max_attempts': spec.max_attempts,
+        'timeout': spec.timeout,
+        'run_after': timezone.now() + timedelta(seconds=delay),
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    job, _ = Job.objects.get_or_create(idempotency_key=key, defaults=fields)
+    return job
+
+
+def _due(now):
+    """Queued jobs whose time has come, and running jobs whose worker stopped renewing the lease"""
+    return Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def claim(worker_id):
+    """Lease the next due job to `worker_id`; None when nothing is due.
+
+    Each candidate is taken with a conditional UPDATE that only matches
+    while it is still due, so of several workers racing for a job exactly
+    one wins, without row locks the SQLite backend doesn't have.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(_due(now))
+        .order_by('-priority', 'run_after', 'id')
+        .values_list('id', 'status', 'attempts', 'max_attempts', 'timeout')[:CLAIM_BATCH]
+    )
+    for job_id, status, attempts, max_attempts, timeout in candidates:
+        if status == Job.RUNNING and attempts >= max_attempts:
+            # Its worker died on the last attempt
+            _fail(Job.objects.filter(_due(now), id=job_id), job_id, f'Lease expired after {attempts} attempts')
+            continue
+        taken = Job.objects.filter(_due(now), id=job_id).update(
+            status=Job.RUNNING,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=timeout),
+            attempts=F('attempts') + 1,
+        )
+        if taken:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def heartbeat():
+    """Renew the lease on the job this process is running, if any.
+
+    run() already does this in the background while a task runs; tasks may
+    also call it between steps, which costs one UPDATE.
+    """
+    job = _leased
+    if job is None:
+        return
+    _renew(job)
+
+
+def _renew(job):
+    Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by).update(
+        locked_until=timezone.now() + timedelta(seconds=job.timeout)
+    )
+
+
+def _keep_leased(job, done):
+    """Renew `job`'s lease every third of its timeout until `done` is set.
+
+    A single step such as encoding one HLS rendition can outlast the
+    timeout, so the lease can't rely on the task calling heartbeat(). It
+    still lapses when the worker process dies.
+    """
+    try:
+        while not done.wait(job.timeout / 3):
+            try:
+                _renew(job)
+            except Exception:
+                logger.exception('Could not renew the lease on job %s', job.id)
+    finally:
+        # This thread has its own database connection
+        connection.close()
+
+
+def run(job):
+    """Run a claimed job and record how it ended"""
+    global _leased
+    leased = Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by)
+    spec = get_task(job.name)
+    started = time.monotonic()
+    _leased = job
+    done = threading.Event()
+    renewer = threading.Thread(target=_keep_leased, args=(job, done), name=f'lease-{job.id}', daemon=True)
+    renewer.start()
+    try:
+        if spec is None:
+            raise LookupError(f'No task named {job.name!r}')
+        spec.func(*job.args)
+    except Exception:
+        logger.exception('Job %s %s%r failed (attempt %s of %s)', job.id, job.name, tuple(job.args),
+                         job.attempts, job.max_attempts)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            leased.update(status=Job.QUEUED, run_after=timezone.now() + retry_delay(job.attempts),
+                          locked_by='', locked_until=None, error=error)
+        else:
+            _fail(leased, job.id, error)
+    else:
+        leased.update(status=Job.DONE, finished_at=timezone.now(), locked_until=None, error='')
+        logger.info('Job %s %s%r done in %.1fs', job.id, job.name, tuple(job.args), time.monotonic() - started)
+    finally:
+        done.set()
+        _leased = None
+
+
+def retry_delay(attempts):
+    """Exponential backoff after `attempts` failures, with jitter so retries spread out"""
+    seconds = min(settings.VIDEO_JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.VIDEO_JOB_RETRY_BACKOFF_MAX)
+    return timedelta(seconds=seconds * random.uniform(0.5, 1.0))
+
+
+def _fail(queryset, job_id, error):
+    if not queryset.update(status=Job.FAILED, finished_at=timezone.now(), locked_until=None, error=error):
+        return
+    job = Job.objects.get(id=job_id)
+    spec = get_task(job.name)
+    if spec is not None and spec.on_failure is not None:
+        try:
+            spec.on_failure(*job.args)
+        except Exception:
+            logger.exception('on_failure of job %s %s failed', job.id, job.name)
+
+
+def retry(queryset):
+    """Queue failed jobs in `queryset` again with fresh attempts; returns how many"""
+    return queryset.filter(status=Job.FAILED).update(
+        status=Job.QUEUED, attempts=0, run_after=timezone.now(), finished_at=None, error=''
+    )
+
+
+def work(stop, burst=False):
+    """Claim and run jobs until the multiprocessing Event `stop` is set.
+
+    In burst mode, return as soon as no job is due. This is the body of
+    each run_worker process.
+    """
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    # Forked workers would otherwise share one jitter sequence
+    random.seed()
+    load_tasks()
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = claim(worker_id)
+            except OperationalError as exc:
+                # SQLite reports 'database is locked' when many workers claim at once
+                logger.warning('Cannot claim a job: %s', exc)
+                job = None
+            if job is not None:
+                run(job)
+            elif burst:
+                return
+            else:
+                stop.wait(settings.VIDEO_JOB_POLL_INTERVAL)
+    finally:
+        connection.close()
+
+
+class PeriodicSchedule:
+    """Queues each VIDEO_PERIODIC_JOBS task once per interval.
+
+    The idempotency key names the interval, so every run_worker on every
+    host can tick its own schedule and each run is still queued once.
+    """
+
+    def __init__(self):
+        self.queued = {}
+
+    def tick(self):
+        now = time.time()
+        for name, interval in settings.VIDEO_PERIODIC_JOBS.items():
+            slot = int(now // interval)
+            if self.queued.get(name) != slot:
+                enqueue(name, key=f'{name}@{slot * interval}')
+                self.queued[name] = slot
+
+
+def prune(days=None):
+    """Delete finished jobs older than VIDEO_JOB_RETENTION_DAYS; returns how many"""
+    cutoff = timezone.now() - timedelta(days=days or settings.VIDEO_JOB_RETENTION_DAYS)
+    deleted, _ = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], finished_at__lt=cutoff).delete()
+    return deleted
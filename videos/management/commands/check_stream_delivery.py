@@ -0,0 +1,109 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+
+from videos.models import Video
+from videos.stream_cache import stream_meta_cache
+from videos.streaming import DELIVERY_BACKENDS
+from videos.views import VideoStreamView
+
+
+class Command(BaseCommand):
+    help = (
+        'Check the headers VideoStreamView sends for each delivery backend '
+        'against a throwaway video. Nothing is left in the database or MEDIA_ROOT.'
+    )
+    payload = bytes(range(256)) * 64
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', choices=DELIVERY_BACKENDS, action='append',
+            help='Backend to check (repeatable, default: all)'
+        )
+
+    def handle(self, *args, **options):
+        backends = options['backend'] or DELIVERY_BACKENDS
+        self.failures = []
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            with transaction.atomic():
+                video = self._create_video()
+                private_video = self._create_video(is_public=False)
+                for backend in backends:
+                    with override_settings(VIDEO_DELIVERY_BACKEND=backend):
+                        stream_meta_cache.clear()
+                        getattr(self, 'check_' + backend.replace('-', '_'))(video, media_root)
+                        self.check_private(backend, private_video)
+                transaction.set_rollback(True)
+        stream_meta_cache.clear()
+
+        if self.failures:
+            raise CommandError(f'{len(self.failures)} check(s) failed')
+        self.stdout.write(self.style.SUCCESS('All delivery checks passed'))
+
+    def _create_video(self, is_public=True):
+        user, _ = User.objects.get_or_create(username='stream-delivery-check')
+        video = Video(title='Delivery check', uploader=user, is_public=is_public)
+        video.video_file.save('check.mp4', ContentFile(self.payload), save=True)
+        return video
+
+    def _get(self, video, **headers):
+        request = RequestFactory().get(f'/stream/{video.id}/', **headers)
+        return VideoStreamView.get(request, video.id)
+
+    def _expect(self, backend, description, condition):
+        if condition:
+            self.stdout.write(f'ok    {backend}: {description}')
+        else:
+            self.failures.append((backend, description))
+            self.stdout.write(self.style.ERROR(f'FAIL  {backend}: {description}'))
+
+    def check_python(self, video, media_root):
+        response = self._get(video)
+        body = b''.join(response.streaming_content)
+        self._expect('python', 'full response is 200 with the file body',
+                     response.status_code == 200 and body == self.payload)
+        self._expect('python', 'Content-Length, ETag and Accept-Ranges are set',
+                     response.get('Content-Length') == str(len(self.payload))
+                     and response.has_header('ETag')
+                     and response.get('Accept-Ranges') == 'bytes')
+
+        response = self._get(video, HTTP_RANGE='bytes=100-199')
+        body = b''.join(response.streaming_content)
+        self._expect('python', 'range request is 206 with Content-Range',
+                     response.status_code == 206
+                     and response.get('Content-Range') == f'bytes 100-199/{len(self.payload)}'
+                     and body == self.payload[100:200])
+
+    def _check_offload(self, backend, video, header, expected):
+        response = self._get(video, HTTP_RANGE='bytes=0-99')
+        self._expect(backend, f'{header} is {expected}', response.get(header) == expected)
+        self._expect(backend, 'response is an empty 200 with the video content type',
+                     response.status_code == 200 and response.content == b''
+                     and response.get('Content-Type') == 'video/mp4')
+        self._expect(backend, 'no Content-Range is sent by Django',
+                     not response.has_header('Content-Range'))
+
+    def check_x_accel_redirect(self, video, media_root):
+        relative_path = os.path.relpath(video.video_file.path, media_root).replace(os.sep, '/')
+        expected = settings.VIDEO_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path
+        self._check_offload('x-accel-redirect', video, 'X-Accel-Redirect', expected)
+
+    def check_x_sendfile(self, video, media_root):
+        self._check_offload('x-sendfile', video, 'X-Sendfile', video.video_file.path)
+
+    def check_private(self, backend, video):
+        try:
+            response = self._get(video)
+        except Http404:
+            self._expect(backend, 'private video is 404', True)
+        else:
+            self._expect(backend, 'private video is 404', False)
+            response.close()
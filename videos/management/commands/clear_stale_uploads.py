@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from videos.uploads import remove_expired
+
+
+class Command(BaseCommand):
+    help = 'Remove resumable uploads idle for longer than VIDEO_UPLOAD_EXPIRY_HOURS, with their partial files.'
+
+    def handle(self, *args, **options):
+        count = remove_expired()
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} stale uploads.'))
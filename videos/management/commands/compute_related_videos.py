@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from videos.related import compute_related
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute the related videos shown on each video page from TF-IDF text '
+        'similarity, co-views and uploader. Run periodically; pass --video to refresh only some videos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', type=int, action='append', help='Video id to refresh (repeatable)')
+        parser.add_argument('--top-k', type=int, help='Related videos kept per video (default: VIDEO_RELATED_COUNT)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = compute_related(options['video'], options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed related videos for {count} videos in {time.monotonic() - started:.1f}s.'
+        ))
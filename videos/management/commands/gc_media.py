@@ -0,0 +1,55 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from videos import gc, jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Find media files and directories nothing references (failed deletes, aborted uploads, '
+        'deleted videos) and report them. Pass --delete to reclaim them now, or --defer to queue '
+        'their deletion for the job workers. The workers also run this daily.'
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument('--delete', action='store_true', help='Delete the orphans now')
+        action.add_argument('--defer', action='store_true', help='Queue deletion jobs for run_worker')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orphans per deletion job with --defer')
+        parser.add_argument('--grace-hours', type=float,
+                            help='Ignore anything newer than this (default: VIDEO_GC_GRACE_HOURS)')
+        parser.add_argument('--workers', type=int, help='Directories scanned in parallel (default: VIDEO_GC_WORKERS)')
+        parser.add_argument('--list', action='store_true', help='Print every orphan')
+
+    def handle(self, *args, **options):
+        orphans = gc.find_orphans(options['grace_hours'], options['workers'])
+        counts, sizes = Counter(), Counter()
+        for orphan in orphans:
+            counts[orphan.category] += 1
+            sizes[orphan.category] += orphan.size
+            if options['list']:
+                self.stdout.write(f'{orphan.name} ({filesizeformat(orphan.size)})')
+        for category in sorted(counts):
+            self.stdout.write(f'{category}: {counts[category]} orphans, {filesizeformat(sizes[category])}')
+        total = filesizeformat(sum(sizes.values()))
+
+        names = [orphan.name for orphan in orphans]
+        if options['delete']:
+            deleted, freed = gc.delete_media(names)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} orphans, freeing {filesizeformat(freed)}.'))
+        elif options['defer']:
+            batch_size = max(1, options['batch_size'])
+            for start in range(0, len(names), batch_size):
+                jobs.enqueue('delete_media', names[start:start + batch_size])
+            self.stdout.write(self.style.SUCCESS(
+                f'Queued deletion of {len(names)} orphans ({total}) in {-(-len(names) // batch_size)} jobs.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Found {len(names)} orphans ({total}) older than '
+                f'{settings.VIDEO_GC_GRACE_HOURS if options["grace_hours"] is None else options["grace_hours"]} hours. '
+                'Run with --delete or --defer to reclaim them.'
+            ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from videos.artwork import generate_artwork
+from videos.models import Video
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate posters, card thumbnails and seek-preview sprites. New uploads get them '
+        'while processing; use this for existing videos or after changing the artwork settings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', type=int, action='append', help='Video id to process (repeatable)')
+        parser.add_argument('--missing', action='store_true', help='Only videos without generated artwork')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.order_by('id')
+        if options['video']:
+            videos = videos.filter(id__in=options['video'])
+        if options['missing']:
+            videos = videos.filter(artwork={})
+        count = 0
+        for video in videos.iterator():
+            artwork = generate_artwork(video)
+            count += 1
+            self.stdout.write(f"Video {video.id}: {', '.join(sorted(artwork)) or 'nothing generated'}")
+        self.stdout.write(self.style.SUCCESS(f'Processed {count} videos.'))
@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from videos.models import Video
+from videos.processing import probe_video
+
+
+class Command(BaseCommand):
+    help = (
+        'Store file size, duration, bitrate, resolution and codecs on videos with ffprobe. '
+        'New uploads are probed while processing; use this to backfill existing videos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', type=int, action='append', help='Video id to probe (repeatable)')
+        parser.add_argument('--missing', action='store_true', help='Only videos not probed yet')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                            help='ffprobe processes run at once (default: CPU count)')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.order_by('id')
+        if options['video']:
+            videos = videos.filter(id__in=options['video'])
+        if options['missing']:
+            videos = videos.filter(duration__isnull=True)
+        video_ids = list(videos.values_list('id', flat=True))
+
+        probed = 0
+        # ffprobe runs as a subprocess, so threads are enough to keep it busy
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            for video_id, ok in zip(video_ids, executor.map(self._probe, video_ids)):
+                probed += ok
+                if not ok:
+                    self.stderr.write(f'Video {video_id}: could not be probed')
+        self.stdout.write(self.style.SUCCESS(f'Probed {probed} of {len(video_ids)} videos.'))
+
+    @staticmethod
+    def _probe(video_id):
+        try:
+            video = Video.objects.filter(id=video_id).first()
+            return video is not None and probe_video(video)
+        finally:
+            # Each pool thread has its own database connection
+            connection.close()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from videos import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of public videos from the videos table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Videos indexed per batch')
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            self.stdout.write(self.style.WARNING(
+                'No full-text index on this database; the home page search uses LIKE filtering.'
+            ))
+            return
+        with transaction.atomic():
+            count = search.rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} videos.'))
@@ -0,0 +1,62 @@
+import logging
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from videos import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (video processing, periodic maintenance) in a pool of worker '
+        'processes. Stop with SIGTERM or Ctrl-C; running jobs finish first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Worker processes (default: VIDEO_JOB_WORKERS)')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is due instead of waiting for more; skips periodic jobs')
+
+    def handle(self, *args, **options):
+        if options['verbosity'] > 0 and not logging.getLogger().handlers:
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s %(message)s')
+        processes = options['processes'] or settings.VIDEO_JOB_WORKERS
+        burst = options['burst']
+        jobs.load_tasks()
+
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        # Forked workers inherit these, so each finishes its job before exiting
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+        schedule = jobs.PeriodicSchedule()
+        workers = [None] * processes
+        self.stdout.write(f'Starting {processes} job workers.')
+        while not stop.is_set():
+            if not burst:
+                schedule.tick()
+            for index, worker in enumerate(workers):
+                if worker is not None and worker.is_alive():
+                    continue
+                if worker is not None:
+                    if burst:
+                        continue
+                    self.stderr.write(f'Worker {worker.pid} exited with code {worker.exitcode}; restarting.')
+                # A forked worker must not share this process's database connection
+                connections.close_all()
+                workers[index] = context.Process(
+                    target=jobs.work, args=(stop, burst), name=f'worker-{index + 1}', daemon=True
+                )
+                workers[index].start()
+            if burst and not any(worker.is_alive() for worker in workers):
+                break
+            stop.wait(settings.VIDEO_JOB_POLL_INTERVAL)
+
+        stop.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Job workers stopped.'))
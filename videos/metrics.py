@@ -0,0 +1,328 @@
+"""
+In-process metrics for the streaming and page views, exported in
+Prometheus text format
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .block_cache import block_cache
+from .pacing import pacing_stats
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+THROUGHPUT_BUCKETS = tuple(2 ** power for power in range(16, 31, 2))  # 64 KiB/s .. 1 GiB/s
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class MetricsRegistry:
+    """Counters and histograms for this process.
+
+    When VIDEO_METRICS_DIR is set every worker periodically writes a
+    snapshot to <dir>/<pid>.json and the metrics endpoint sums the snapshots
+    of all workers, so gunicorn's process model doesn't split the numbers.
+    Snapshots of workers that have exited are removed when scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._meta = {}
+        self._last_flush = 0.0
+        self._collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._meta[name] = {'type': kind, 'help': help_text, 'buckets': buckets}
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=None):
+        buckets = self._meta[name]['buckets']
+        key = self._key(name, labels)
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+        self._maybe_flush()
+
+    def register_collector(self, collector):
+        """Register a callable returning (name, value) pairs read at flush/scrape time"""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """JSON-serialisable copy of this process's metrics"""
+        gauges = []
+        for collector in self._collectors:
+            for name, value in collector():
+                gauges.append([name, [], value])
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), dict(state, buckets=list(state['buckets']))]
+                    for (name, labels), state in self._histograms.items()
+                ],
+                'gauges': gauges,
+            }
+
+    def _maybe_flush(self):
+        if settings.VIDEO_METRICS_DIR and time.monotonic() - self._last_flush >= settings.VIDEO_METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot into VIDEO_METRICS_DIR"""
+        directory = settings.VIDEO_METRICS_DIR
+        if not directory:
+            return
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Snapshots to export: every worker's file, or just this process"""
+        directory = settings.VIDEO_METRICS_DIR
+        if not directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        stale = time.time() - settings.VIDEO_METRICS_STALE_SECONDS
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            pid = filename.split('.', 1)[0]
+            try:
+                if not (pid.isascii() and pid.isdigit() and _pid_alive(int(pid))) or os.path.getmtime(path) < stale:
+                    # Left by a worker that exited, or one on another host that stopped writing
+                    os.remove(path)
+                    continue
+                if filename.endswith('.json'):
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """Merge snapshots and render them in Prometheus text format"""
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, state in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, {'buckets': [0] * len(state['buckets']), 'sum': 0.0, 'count': 0})
+                merged['buckets'] = [a + b for a, b in zip(merged['buckets'], state['buckets'])]
+                merged['sum'] += state['sum']
+                merged['count'] += state['count']
+
+        lines = []
+        for name in sorted({key[0] for key in (*counters, *gauges, *histograms)}):
+            meta = self._meta.get(name, {'type': 'untyped', 'help': name})
+            lines.append(f'# HELP {name} {meta["help"]}')
+            lines.append(f'# TYPE {name} {meta["type"]}')
+            for values in (counters, gauges):
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for (metric, labels), state in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(meta['buckets'], state['buckets']):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {state["count"]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(state["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {state["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+registry.describe('videostream_page_requests_total', 'counter', 'Page view responses by view and status')
+registry.describe('videostream_page_duration_seconds', 'histogram', 'Page view latency', LATENCY_BUCKETS)
+registry.describe('videostream_stream_responses_total', 'counter', 'Stream responses by status code')
+registry.describe('videostream_stream_bytes_total', 'counter', 'Video bytes served by video')
+registry.describe('videostream_stream_ttfb_seconds', 'histogram', 'Time to first body byte of stream responses', LATENCY_BUCKETS)
+registry.describe('videostream_stream_throughput_bytes_per_second', 'histogram', 'Average throughput per stream connection', THROUGHPUT_BUCKETS)
+registry.describe('videostream_db_queries_per_request', 'histogram', 'Database queries run per request by view', QUERY_BUCKETS)
+registry.describe('videostream_db_query_seconds_total', 'counter', 'Time spent in database queries by view')
+registry.describe('videostream_db_query_budget_exceeded_total', 'counter', 'Requests that ran more queries than their view budget')
+atexit.register(registry.flush)
+
+registry.describe('videostream_block_cache_hits_total', 'counter', 'Ranges served entirely from the block cache')
+registry.describe('videostream_block_cache_misses_total', 'counter', 'Ranges that needed blocks not in the block cache')
+registry.describe('videostream_block_cache_evictions_total', 'counter', 'Blocks evicted from the block cache')
+registry.describe('videostream_block_cache_blocks', 'gauge', 'Blocks held in the block cache')
+registry.describe('videostream_block_cache_bytes', 'gauge', 'Bytes held in the block cache')
+registry.describe('videostream_pacing_streams_total', 'counter', 'Stream responses sent through a pacer')
+registry.describe('videostream_pacing_active_streams', 'gauge', 'Paced stream responses in progress')
+registry.describe('videostream_pacing_burst_bytes_total', 'counter', 'Bytes sent unpaced in the start-up burst')
+registry.describe('videostream_pacing_paced_bytes_total', 'counter', 'Bytes sent under the per-stream rate limit')
+registry.describe('videostream_pacing_stream_wait_seconds_total', 'counter', 'Time streams waited on their own rate limit')
+registry.describe('videostream_pacing_egress_wait_seconds_total', 'counter', 'Time streams waited on VIDEO_EGRESS_LIMIT')
+
+
+def _block_cache_metrics():
+    stats = block_cache.stats()
+    return [
+        ('videostream_block_cache_hits_total', stats['hits']),
+        ('videostream_block_cache_misses_total', stats['misses']),
+        ('videostream_block_cache_evictions_total', stats['evictions']),
+        ('videostream_block_cache_blocks', stats['blocks']),
+        ('videostream_block_cache_bytes', stats['bytes']),
+    ]
+
+
+def _pacing_metrics():
+    stats = pacing_stats.snapshot()
+    return [
+        ('videostream_pacing_streams_total', stats['streams']),
+        ('videostream_pacing_active_streams', stats['active_streams']),
+        ('videostream_pacing_burst_bytes_total', stats['burst_bytes']),
+        ('videostream_pacing_paced_bytes_total', stats['paced_bytes']),
+        ('videostream_pacing_stream_wait_seconds_total', stats['stream_wait_seconds']),
+        ('videostream_pacing_egress_wait_seconds_total', stats['egress_wait_seconds']),
+    ]
+
+
+registry.register_collector(_block_cache_metrics)
+registry.register_collector(_pacing_metrics)
+
+
+def instrument_page(view):
+    """Record request count and latency for a page view"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = view(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            labels = {'view': view.__name__, 'status': str(status)}
+            registry.inc('videostream_page_requests_total', labels)
+            registry.observe('videostream_page_duration_seconds', time.perf_counter() - started, {'view': view.__name__})
+    return wrapper
+
+
+class StreamRecorder:
+    """Tracks one stream response: first byte, bytes sent and duration"""
+
+    def __init__(self, video_id, started):
+        self.video_id = str(video_id)
+        self.started = started
+        self.first_byte_at = None
+        self.bytes_sent = 0
+        self.finished = False
+
+    def sent(self, amount):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            registry.observe('videostream_stream_ttfb_seconds', self.first_byte_at - self.started)
+        self.bytes_sent += amount
+
+    def finish(self):
+        """Count the bytes and the throughput over the whole response, from the request to close"""
+        if self.finished:
+            return
+        self.finished = True
+        registry.inc('videostream_stream_bytes_total', {'video': self.video_id}, self.bytes_sent)
+        if self.bytes_sent:
+            elapsed = max(time.perf_counter() - self.started, 1e-6)
+            registry.observe('videostream_stream_throughput_bytes_per_second', self.bytes_sent / elapsed)
+
+
+def instrument_stream(response, video_id, started):
+    """Attach byte, TTFB and throughput accounting to a stream response.
+
+    Responses sent through wsgi.file_wrapper (sendfile) never pass through
+    Python, so for those the time the response is handed to the server
+    stands in for the first byte, and the promised Content-Length is
+    counted as sent.
+    """
+    registry.inc('videostream_stream_responses_total', {'status': str(response.status_code)})
+    if not response.streaming:
+        return response
+
+    recorder = StreamRecorder(video_id, started)
+    if getattr(response, 'file_to_stream', None) is not None:
+        recorder.sent(int(response.get('Content-Length', 0)))
+    elif response.is_async:
+        response.streaming_content = _acount(response.streaming_content, recorder)
+    else:
+        response.streaming_content = _count(response.streaming_content, recorder)
+
+    close = response.close
+
+    def close_and_record():
+        try:
+            close()
+        finally:
+            recorder.finish()
+
+    response.close = close_and_record
+    return response
+
+
+def _count(chunks, recorder):
+    for chunk in chunks:
+        recorder.sent(len(chunk))
+        yield chunk
+
+
+async def _acount(chunks, recorder):
+    async for chunk in chunks:
+        recorder.sent(len(chunk))
+        yield chunk
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 01:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0003_remove_adview_ad_remove_adview_user_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Ladder rung, e.g. 720p', max_length=20)),
+                ('width', models.PositiveIntegerField(default=0)),
+                ('height', models.PositiveIntegerField()),
+                ('video_bitrate', models.PositiveIntegerField(help_text='Target video bitrate in kbps')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='videos.video')),
+            ],
+            options={
+                'ordering': ['-height'],
+                'unique_together': {('video', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0004_videorendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='keyframe_index',
+            field=models.BinaryField(blank=True, help_text='Packed (ms, byte offset) pairs for video keyframes', null=True),
+        ),
+    ]
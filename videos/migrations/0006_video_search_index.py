@@ -0,0 +1,77 @@
+from django.db import migrations, OperationalError
+
+# The index as this migration creates it; videos.search maintains it afterwards
+SQLITE_TABLE = 'videos_video_fts'
+POSTGRES_TABLE = 'videos_video_search'
+
+
+def _clean(text):
+    # Drop the highlight markers search results are given
+    return (text or '').replace('\x02', '').replace('\x03', '')
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5('
+                "title, description, uploader, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        except OperationalError:
+            # SQLite compiled without FTS5: searches fall back to LIKE
+            return
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ('
+            'video_id bigint PRIMARY KEY REFERENCES videos_video (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'title text NOT NULL, description text NOT NULL, document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_idx ON {POSTGRES_TABLE} USING GIN (document)'
+        )
+    else:
+        return
+
+    Video = apps.get_model('videos', 'Video')
+    rows = [
+        (video_id, _clean(title), _clean(description), _clean(uploader))
+        for video_id, title, description, uploader in Video.objects.filter(is_public=True).values_list(
+            'id', 'title', 'description', 'uploader__username'
+        ).iterator()
+    ]
+    if not rows:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, title, description, uploader) VALUES (%s, %s, %s, %s)', rows
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {POSTGRES_TABLE} (video_id, title, description, document) VALUES (%s, %s, %s, '
+                "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C')) ON CONFLICT (video_id) DO NOTHING",
+                [(video_id, title, description, title, uploader, description)
+                 for video_id, title, description, uploader in rows],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {POSTGRES_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0005_video_keyframe_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
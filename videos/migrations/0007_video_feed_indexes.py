@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0006_video_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='video',
+            options={'ordering': ['-uploaded_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['is_public', 'uploaded_at', 'id'], name='video_public_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['uploader', 'uploaded_at', 'id'], name='video_uploader_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 02:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Video = apps.get_model('videos', 'Video')
+    Comment = apps.get_model('videos', 'Comment')
+    counts = (
+        Comment.objects.filter(video=OuterRef('pk'))
+        .order_by().values('video').annotate(total=Count('id')).values('total')
+    )
+    Video.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0008_related_videos'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['video', 'created_at', 'id'], name='comment_video_feed_idx'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0009_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='artwork',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Generated poster, thumbnail and sprite file names'),
+        ),
+    ]
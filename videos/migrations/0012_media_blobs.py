@@ -0,0 +1,65 @@
+# Generated by Django 4.2 on 2026-10-18 02:23
+
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+import videos.models
+import videos.storage
+
+
+def count_references(apps, schema_editor):
+    """Create MediaBlob rows for the files existing rows already reference"""
+    Video = apps.get_model('videos', 'Video')
+    UploadSession = apps.get_model('videos', 'UploadSession')
+    MediaBlob = apps.get_model('videos', 'MediaBlob')
+    counts = Counter()
+    for video_file, thumbnail in Video.objects.values_list('video_file', 'thumbnail').iterator():
+        counts.update(name for name in (video_file, thumbnail) if name)
+    counts.update(name for name in UploadSession.objects.values_list('thumbnail', flat=True) if name)
+
+    blobs = []
+    for name, refcount in counts.items():
+        try:
+            size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, name))
+        except OSError:
+            size = 0
+        blobs.append(MediaBlob(name=name, size=size, refcount=refcount))
+    MediaBlob.objects.bulk_create(blobs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0011_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Path relative to MEDIA_ROOT', max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=videos.storage.ContentAddressedStorage(), upload_to=videos.models.thumbnail_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=videos.storage.ContentAddressedStorage(), upload_to=videos.models.thumbnail_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='video_file',
+            field=models.FileField(storage=videos.storage.ContentAddressedStorage(), upload_to=videos.models.video_upload_path),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
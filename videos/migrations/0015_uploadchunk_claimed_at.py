@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 03:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0014_media_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadchunk',
+            name='claimed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='uploadchunk',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
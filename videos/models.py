@@ -1,9 +1,15 @@
 import os
+import struct
 import uuid
+from bisect import bisect_right
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.timesince import timesince
+
+from .storage import media_storage
 
 
 def video_upload_path(instance, filename):
@@ -20,18 +26,55 @@ def thumbnail_upload_path(instance, filename):
     return os.path.join('thumbnails', filename)
 
 
+# Keyframe index record: presentation time in milliseconds, byte offset
+KEYFRAME_RECORD = struct.Struct('<IQ')
+
+
 class Video(models.Model):
+    # Processing pipeline state, reported by the worker running process_video
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    PROCESSING_CHOICES = [
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
-    video_file = models.FileField(upload_to=video_upload_path)
-    thumbnail = models.ImageField(upload_to=thumbnail_upload_path, blank=True, null=True)
+    video_file = models.FileField(upload_to=video_upload_path, storage=media_storage)
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_path, storage=media_storage, blank=True, null=True)
     uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_videos')
     views = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
     uploaded_at = models.DateTimeField(default=timezone.now)
     is_public = models.BooleanField(default=True)
+    keyframe_index = models.BinaryField(null=True, blank=True, editable=False,
+                                        help_text="Packed (ms, byte offset) pairs for video keyframes")
+    artwork = models.JSONField(default=dict, blank=True, editable=False,
+                               help_text="Generated poster, thumbnail and sprite file names")
+    # Media information read by ffprobe while processing
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False, help_text="Bytes")
+    duration = models.FloatField(null=True, blank=True, editable=False, help_text="Seconds")
+    bitrate = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text="Average bits/s")
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    video_codec = models.CharField(max_length=32, blank=True, editable=False)
+    audio_codec = models.CharField(max_length=32, blank=True, editable=False)
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_CHOICES, default=READY, editable=False)
+    processing_progress = models.PositiveSmallIntegerField(default=100, editable=False, help_text="Percent done")
+    processing_stage = models.CharField(max_length=100, blank=True, editable=False)
 
     class Meta:
-        ordering = ['-uploaded_at']
+        ordering = ['-uploaded_at', '-id']
+        indexes = [
+            # Keyset pagination of the home and my_videos feeds
+            models.Index(fields=['is_public', 'uploaded_at', 'id'], name='video_public_feed_idx'),
+            models.Index(fields=['uploader', 'uploaded_at', 'id'], name='video_uploader_feed_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -39,17 +82,109 @@ class Video(models.Model):
     def get_absolute_url(self):
         return reverse('video_detail', kwargs={'video_id': str(self.id)})
 
-    def increment_views(self):
-        """Increment view count"""
-        self.views += 1
-        self.save(update_fields=['views'])
+    def increment_views(self, request=None):
+        """Count a view; the database write is buffered by videos.view_counter"""
+        from .view_counter import view_counter
+        if view_counter.record(self.id, request):
+            self.views += 1
+
+    @property
+    def is_processing(self):
+        return self.processing_status in (self.QUEUED, self.PROCESSING)
 
     def get_file_size(self):
         """Return file size in MB"""
+        if self.file_size is not None:
+            return round(self.file_size / (1024 * 1024), 2)
+        # Not probed yet (see the probe_videos command): stat the file
         if self.video_file:
             return round(self.video_file.size / (1024 * 1024), 2)
         return 0
 
+    @property
+    def duration_display(self):
+        """Duration as m:ss or h:mm:ss; empty when unknown"""
+        if self.duration is None:
+            return ''
+        minutes, seconds = divmod(int(round(self.duration)), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            return f'{hours}:{minutes:02d}:{seconds:02d}'
+        return f'{minutes}:{seconds:02d}'
+
+    @property
+    def resolution_display(self):
+        """Frame height as e.g. 1080p; empty when unknown"""
+        return f'{self.height}p' if self.height else ''
+
+    def set_keyframe_index(self, keyframes):
+        """Store (seconds, byte offset) keyframe pairs in packed form"""
+        self.keyframe_index = b''.join(
+            KEYFRAME_RECORD.pack(int(round(seconds * 1000)), offset)
+            for seconds, offset in sorted(keyframes)
+        )
+
+    def get_keyframes(self):
+        """Return the keyframe index as a list of (seconds, byte offset)"""
+        data = bytes(self.keyframe_index or b'')
+        return [(ms / 1000, offset) for ms, offset in KEYFRAME_RECORD.iter_unpack(data)]
+
+    def keyframe_at(self, seconds):
+        """Last keyframe at or before `seconds`, or None without an index"""
+        keyframes = self.get_keyframes()
+        if not keyframes:
+            return None
+        position = bisect_right([time for time, _ in keyframes], seconds)
+        return keyframes[max(position - 1, 0)]
+
+    @property
+    def hls_dir(self):
+        """Directory under MEDIA_ROOT holding this video's HLS renditions"""
+        return os.path.join('hls', str(self.id))
+
+    @property
+    def artwork_dir(self):
+        """Directory under MEDIA_ROOT holding this video's generated images"""
+        return os.path.join('artwork', str(self.id))
+
+    def artwork_url(self, name):
+        return reverse('artwork_file', kwargs={'video_id': self.id, 'filename': name})
+
+    @property
+    def poster_url(self):
+        """Generated poster, falling back to the uploaded thumbnail"""
+        if self.artwork.get('poster'):
+            return self.artwork_url(self.artwork['poster'])
+        return self.thumbnail.url if self.thumbnail else ''
+
+    @property
+    def thumbnail_srcset(self):
+        """{'webp': srcset, 'jpeg': srcset} over the generated card sizes"""
+        thumbnails = self.artwork.get('thumbnails', [])
+        return {
+            image_format: ', '.join(
+                f"{self.artwork_url(thumbnail[image_format])} {thumbnail['width']}w" for thumbnail in thumbnails
+            )
+            for image_format in ('webp', 'jpeg')
+        }
+
+    @property
+    def thumbnail_src(self):
+        """Smallest generated JPEG thumbnail, for browsers without srcset"""
+        thumbnails = self.artwork.get('thumbnails')
+        return self.artwork_url(thumbnails[0]['jpeg']) if thumbnails else ''
+
+    @property
+    def preview_sprite_url(self):
+        """WebVTT index of the seek-preview sprite"""
+        sprite = self.artwork.get('sprite')
+        return self.artwork_url(sprite['vtt']) if sprite else ''
+
+    @property
+    def has_hls(self):
+        """True once at least one HLS rendition has been packaged"""
+        return any(rendition.status == VideoRendition.READY for rendition in self.renditions.all())
+
 
 class Comment(models.Model):
     video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='comments')
@@ -58,7 +193,205 @@ class Comment(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination of a video's comments
+            models.Index(fields=['video', 'created_at', 'id'], name='comment_video_feed_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user.username} on {self.video.title}'
+
+    def as_json(self):
+        return {
+            'id': self.id,
+            'user': self.user.get_full_name() or self.user.username,
+            'content': self.content,
+            'created_at': self.created_at.isoformat(),
+            'timesince': timesince(self.created_at),
+        }
+
+
+class VideoRendition(models.Model):
+    """One rung of a video's HLS adaptive-bitrate ladder"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='renditions')
+    name = models.CharField(max_length=20, help_text="Ladder rung, e.g. 720p")
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField()
+    video_bitrate = models.PositiveIntegerField(help_text="Target video bitrate in kbps")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-height']
+        unique_together = ('video', 'name')
+
+    def __str__(self):
+        return f'{self.video.title} - {self.name} ({self.status})'
+
+    @property
+    def playlist_name(self):
+        """Playlist path relative to the video's HLS directory"""
+        return f'{self.name}/index.m3u8'
+
+
+class VideoCoView(models.Model):
+    """How often two videos were watched by the same viewer within a session.
+
+    Each pair is stored once, with video_id < other_id.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('video', 'other')
+
+    def __str__(self):
+        return f'{self.video_id} & {self.other_id}: {self.count}'
+
+
+class RelatedVideo(models.Model):
+    """Precomputed top-K related videos, written by compute_related_videos"""
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = ('video', 'rank')
+
+    def __str__(self):
+        return f'{self.video_id} -> {self.related_id} (#{self.rank})'
+
+
+class UploadSession(models.Model):
+    """A resumable upload: the video arrives in fixed-size chunks written
+    into MEDIA_ROOT/<VIDEO_UPLOAD_DIR>/<id>.part, then becomes a Video.
+    """
+    UPLOADING = 'uploading'
+    COMPLETING = 'completing'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (COMPLETING, 'Completing'),
+        (COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text="Total bytes of the video")
+    chunk_size = models.PositiveIntegerField()
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_path, storage=media_storage, blank=True, null=True)
+    is_public = models.BooleanField(default=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
+    video = models.ForeignKey(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.status})'
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Bytes expected in chunk `index`; only the last one may be short"""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    @property
+    def part_path(self):
+        """Absolute path of the file the chunks are written into"""
+        return os.path.join(settings.MEDIA_ROOT, settings.VIDEO_UPLOAD_DIR, f'{self.id}.part')
+
+
+class UploadChunk(models.Model):
+    """A chunk of an UploadSession that arrived with the right length and checksum.
+
+    The row is inserted before the bytes are written, to claim the chunk;
+    sha256 stays empty until the write has finished.
+    """
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    claimed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+    def __str__(self):
+        return f'{self.session_id} #{self.index}'
+
+
+class MediaBlob(models.Model):
+    """A stored media file and the number of model fields referencing it.
+
+    Maintained by signals on the models with media fields; the file is
+    deleted when the count drops to zero.
+    """
+    name = models.CharField(max_length=255, unique=True, help_text="Path relative to MEDIA_ROOT")
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} references)'
+
+
+class Job(models.Model):
+    """A unit of background work run by `manage.py run_worker`; see videos.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, help_text="Registered task name")
+    args = models.JSONField(default=list, blank=True)
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True,
+                                       help_text="Enqueueing a key that exists returns the existing job")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    run_after = models.DateTimeField(default=timezone.now)
+    timeout = models.PositiveIntegerField(help_text="Visibility timeout in seconds")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True,
+                                        help_text="A running job not renewed by then is given to another worker")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Claiming: due queued jobs by priority, and expired running ones
+            models.Index(fields=['status', 'priority', 'run_after'], name='job_claim_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_lock_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)!r} ({self.status})'
@@ -1,18 +1,165 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.cache import caches
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db.models import Sum, Count
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
 from django.utils import timezone
+from collections import Counter, namedtuple
 from datetime import timedelta
+from decimal import Decimal
 import json
 
+from .clients import client_ip
 from .models import Video
 from .monetization_models import Ad, VideoAd, AdCampaign, AdView, Revenue, CreatorEarnings, Tip, SubscriptionPlan, UserSubscription, Payment
 
 
+# What an ad beacon needs to know about the ad and its campaign
+AdRate = namedtuple('AdRate', ['title', 'duration', 'cost_per_view', 'cost_per_click', 'starts_at', 'ends_at'])
+
+
+def ad_rates(ad_ids):
+    """{ad id: AdRate} for the active ads of active campaigns among `ad_ids`.
+
+    Entries, including misses, are cached for VIDEO_AD_CACHE_TTL seconds,
+    so a beacon usually doesn't read the ad tables at all.
+    """
+    cache = caches[settings.VIDEO_AD_CACHE_ALIAS]
+    keys = {ad_id: f'ad-rate:{ad_id}' for ad_id in set(ad_ids)}
+    cached = cache.get_many(keys.values())
+    rates = {ad_id: cached[key] for ad_id, key in keys.items() if key in cached}
+
+    missing = [ad_id for ad_id in keys if ad_id not in rates]
+    if missing:
+        loaded = dict.fromkeys(missing)
+        ads = Ad.objects.filter(id__in=missing, is_active=True, campaign__is_active=True).values_list(
+            'id', 'title', 'duration', 'campaign__cost_per_view', 'campaign__cost_per_click',
+            'campaign__start_date', 'campaign__end_date',
+        )
+        for ad_id, *fields in ads:
+            loaded[ad_id] = AdRate(*fields)
+        cache.set_many({keys[ad_id]: rate for ad_id, rate in loaded.items()}, settings.VIDEO_AD_CACHE_TTL)
+        rates.update(loaded)
+
+    now = timezone.now()
+    return {ad_id: rate for ad_id, rate in rates.items() if rate is not None and rate.starts_at <= now < rate.ends_at}
+
+
+def credit_earnings(amounts):
+    """Add {user id: amount} to CreatorEarnings.
+
+    All creators are credited by a single UPDATE of F() increments, so
+    concurrent credits add up instead of overwriting each other, and a
+    batch touching many creators still costs one statement.
+    """
+    if not amounts:
+        return
+    CreatorEarnings.objects.bulk_create([CreatorEarnings(user_id=user_id) for user_id in amounts], ignore_conflicts=True)
+    credit = Case(
+        *(When(user_id=user_id, then=Value(amount)) for user_id, amount in amounts.items()),
+        output_field=DecimalField(max_digits=10, decimal_places=4),
+    )
+    CreatorEarnings.objects.filter(user_id__in=amounts).update(
+        total_earned=F('total_earned') + credit,
+        pending_amount=F('pending_amount') + credit,
+        updated_at=timezone.now(),
+    )
+
+
+def record_ad_events(events, user, ip_address):
+    """Validate and store a batch of ad beacons.
+
+    Each event is a dict with ad_id, video_id, duration_watched and
+    was_clicked (a JSON boolean). Valid ones become AdView and Revenue rows
+    written with bulk_create, and the revenue is credited to each creator
+    once per batch, all in one transaction. A viewer (their user, or their
+    address when anonymous) earns revenue for an ad at most once per
+    VIDEO_AD_CREDIT_WINDOW; repeats are still recorded as views, worth
+    nothing. Returns an (amount, error) pair per event; error is None for
+    recorded events.
+    """
+    results = [None] * len(events)
+    parsed = []
+    for index, event in enumerate(events):
+        try:
+            ad_id, video_id = int(event['ad_id']), int(event['video_id'])
+            duration_watched = int(event.get('duration_watched', 0))
+            was_clicked = event.get('was_clicked', False)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            results[index] = (Decimal(0), 'Invalid event')
+            continue
+        # bool('false') is True, so only real booleans can count as a click
+        if duration_watched < 0 or not isinstance(was_clicked, bool):
+            results[index] = (Decimal(0), 'Invalid event')
+            continue
+        parsed.append((index, ad_id, video_id, duration_watched, was_clicked))
+
+    rates = ad_rates(ad_id for _, ad_id, _, _, _ in parsed)
+    uploaders = dict(Video.objects.filter(id__in={video_id for _, _, video_id, _, _ in parsed}).values_list('id', 'uploader_id'))
+    viewer = user if user.is_authenticated else None
+    viewer_key = f'user:{user.pk}' if viewer else f'ip:{ip_address}'
+    now = timezone.now()
+    accepted = []
+    for index, ad_id, video_id, duration_watched, was_clicked in parsed:
+        rate = rates.get(ad_id)
+        if rate is None:
+            results[index] = (Decimal(0), 'Unknown or inactive ad')
+            continue
+        uploader_id = uploaders.get(video_id)
+        if uploader_id is None:
+            results[index] = (Decimal(0), 'Unknown video')
+            continue
+
+        # Revenue based on ad type and engagement
+        amount = Decimal(0)
+        if was_clicked:
+            amount = rate.cost_per_click
+        elif duration_watched >= rate.duration * 0.5:  # Watched at least 50%
+            amount = rate.cost_per_view
+        # Don't count own views
+        if uploader_id == user.id:
+            amount = Decimal(0)
+        accepted.append((index, ad_id, video_id, uploader_id, duration_watched, was_clicked, amount, rate))
+
+    # Ads this viewer already earned a creator revenue from recently
+    cache = caches[settings.VIDEO_AD_CREDIT_CACHE]
+    credit_keys = {ad_id: f'ad-credit:{ad_id}:{viewer_key}' for _, ad_id, _, _, _, _, amount, _ in accepted if amount}
+    credited = set(cache.get_many(credit_keys.values()))
+    newly_credited = set()
+    ad_views, revenues, earnings = [], [], Counter()
+    for index, ad_id, video_id, uploader_id, duration_watched, was_clicked, amount, rate in accepted:
+        if amount:
+            if credit_keys[ad_id] in credited:
+                amount = Decimal(0)
+            else:
+                credited.add(credit_keys[ad_id])
+                newly_credited.add(credit_keys[ad_id])
+        ad_views.append(AdView(
+            ad_id=ad_id, video_id=video_id, user=viewer, ip_address=ip_address, viewed_at=now,
+            duration_watched=duration_watched, was_clicked=was_clicked, revenue_earned=amount,
+        ))
+        if amount:
+            revenues.append(Revenue(
+                video_id=video_id, user_id=uploader_id, revenue_type='ad_views', amount=amount,
+                description=f'Ad view: {rate.title}', created_at=now,
+            ))
+            earnings[uploader_id] += amount
+        results[index] = (amount, None)
+
+    with transaction.atomic():
+        AdView.objects.bulk_create(ad_views)
+        Revenue.objects.bulk_create(revenues)
+        credit_earnings(earnings)
+    if newly_credited:
+        cache.set_many(dict.fromkeys(newly_credited, 1), settings.VIDEO_AD_CREDIT_WINDOW)
+    return results
+
+
 @login_required
 def monetization_dashboard(request):
     """Creator's monetization dashboard"""
@@ -86,54 +233,42 @@ def track_ad_view(request, ad_id):
     """Track ad view for revenue calculation"""
     try:
         data = json.loads(request.body)
-        video_id = data.get('video_id')
-        duration_watched = data.get('duration_watched', 0)
-        was_clicked = data.get('was_clicked', False)
-        
-        ad = get_object_or_404(Ad, id=ad_id)
-        video = get_object_or_404(Video, id=video_id)
-        
-        # Calculate revenue based on ad type and engagement
-        revenue_earned = 0
-        if was_clicked:
-            revenue_earned = float(ad.campaign.cost_per_click)
-        else:
-            # Revenue based on view duration
-            if duration_watched >= ad.duration * 0.5:  # Watched at least 50%
-                revenue_earned = float(ad.campaign.cost_per_view)
-        
-        # Create ad view record
-        ad_view = AdView.objects.create(
-            ad=ad,
-            video=video,
-            user=request.user if request.user.is_authenticated else None,
-            ip_address=request.META.get('REMOTE_ADDR'),
-            duration_watched=duration_watched,
-            was_clicked=was_clicked,
-            revenue_earned=revenue_earned
-        )
-        
-        # Update creator earnings
-        if video.uploader != request.user:  # Don't count own views
-            Revenue.objects.create(
-                video=video,
-                user=video.uploader,
-                revenue_type='ad_views',
-                amount=revenue_earned,
-                description=f'Ad view: {ad.title}'
-            )
-            
-            # Update creator earnings
-            earnings, created = CreatorEarnings.objects.get_or_create(user=video.uploader)
-            earnings.total_earned += revenue_earned
-            earnings.pending_amount += revenue_earned
-            earnings.save()
-        
-        return JsonResponse({'success': True, 'revenue': float(revenue_earned)})
-        
-    except Exception as e:
+        event = dict(data, ad_id=ad_id)
+    except (ValueError, TypeError) as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
+    [(revenue_earned, error)] = record_ad_events([event], request.user, client_ip(request))
+    if error:
+        return JsonResponse({'success': False, 'error': error})
+    return JsonResponse({'success': True, 'revenue': float(revenue_earned)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def track_ad_events(request):
+    """Track a batch of ad views: {"events": [{"ad_id", "video_id", "duration_watched", "was_clicked"}, ...]}"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list) or not events:
+        return JsonResponse({'success': False, 'error': 'Expected a list of events'}, status=400)
+    if len(events) > settings.VIDEO_AD_EVENTS_MAX_BATCH:
+        return JsonResponse(
+            {'success': False, 'error': f'At most {settings.VIDEO_AD_EVENTS_MAX_BATCH} events per request'},
+            status=400,
+        )
+
+    results = record_ad_events(events, request.user, client_ip(request))
+    rejected = [{'index': index, 'error': error} for index, (_, error) in enumerate(results) if error]
+    return JsonResponse({
+        'success': True,
+        'accepted': len(results) - len(rejected),
+        'rejected': rejected,
+        'revenue': float(sum(amount for amount, _ in results)),
+    })
+
 
 @login_required
 def send_tip(request, video_id):
@@ -167,10 +302,7 @@ def send_tip(request, video_id):
             description=f'Tip from {request.user.username if not is_anonymous else "Anonymous"}'
         )
         
-        earnings, created = CreatorEarnings.objects.get_or_create(user=video.uploader)
-        earnings.total_earned += amount
-        earnings.pending_amount += amount
-        earnings.save()
+        credit_earnings({video.uploader_id: Decimal(str(amount))})
         
         messages.success(request, f'Tip of ${amount} sent successfully!')
         return redirect('video_detail', video_id=video_id)
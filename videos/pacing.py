@@ -0,0 +1,217 @@
+"""
+Bandwidth pacing for stream responses
+"""
+
+import asyncio
+import hashlib
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .clients import client_ip
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` bytes per second, holding at most `capacity`.
+
+    `reserve()` always takes the tokens, letting the balance go negative,
+    and returns how long the caller should wait before sending them; this
+    keeps concurrent callers of a shared bucket fair without a wait queue.
+    """
+
+    def __init__(self, rate, capacity, tokens=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class PacingStats:
+    """Process-wide counters describing how much pacing is slowing streams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.active_streams = 0
+        self.burst_bytes = 0
+        self.paced_bytes = 0
+        self.stream_wait_seconds = 0.0
+        self.egress_wait_seconds = 0.0
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'streams': self.streams,
+                'active_streams': self.active_streams,
+                'burst_bytes': self.burst_bytes,
+                'paced_bytes': self.paced_bytes,
+                'stream_wait_seconds': self.stream_wait_seconds,
+                'egress_wait_seconds': self.egress_wait_seconds,
+            }
+
+
+pacing_stats = PacingStats()
+
+_egress_bucket = None
+_egress_lock = threading.Lock()
+
+
+def _egress():
+    """Process-wide bucket enforcing VIDEO_EGRESS_LIMIT, or None"""
+    global _egress_bucket
+    limit = settings.VIDEO_EGRESS_LIMIT
+    if not limit:
+        return None
+    with _egress_lock:
+        if _egress_bucket is None or _egress_bucket.rate != limit:
+            _egress_bucket = TokenBucket(limit, limit)
+    return _egress_bucket
+
+
+def is_active():
+    """True if stream bytes have to go through a pacer"""
+    return settings.VIDEO_PACING_ENABLED or bool(settings.VIDEO_EGRESS_LIMIT)
+
+
+def burst_key(request, path):
+    """Cache key of the burst allowance the requesting client has left for a file"""
+    digest = hashlib.sha1(f'{client_ip(request)}:{path}'.encode()).hexdigest()
+    return f'pacing-burst:{digest}'
+
+
+class StreamPacer:
+    """Pacing state for one stream response.
+
+    The first VIDEO_PACING_BURST_SECONDS of playback go out unpaced for a
+    fast start; after that the stream is held to the video's bitrate times
+    VIDEO_PACING_BITRATE_MULTIPLIER, and every stream in the process shares
+    the VIDEO_EGRESS_LIMIT budget.
+
+    With a `burst_key` the burst belongs to the client and file rather than
+    the response: it is kept in VIDEO_PACING_BURST_CACHE, each response
+    takes what is left, and it refills at playback speed, so opening new
+    range requests doesn't buy a fresh burst every time.
+    """
+
+    def __init__(self, bitrate, burst_key=None):
+        bitrate = bitrate or settings.VIDEO_PACING_DEFAULT_BITRATE
+        self.stream_bucket = None
+        self.burst_remaining = 0
+        self.burst_key = None
+        if settings.VIDEO_PACING_ENABLED:
+            rate = bitrate / 8 * settings.VIDEO_PACING_BITRATE_MULTIPLIER
+            self.stream_bucket = TokenBucket(rate, rate, tokens=0)
+            self.burst_rate = bitrate / 8
+            self.burst_capacity = int(self.burst_rate * settings.VIDEO_PACING_BURST_SECONDS)
+            self.burst_remaining = self.burst_capacity
+            if burst_key is not None and self.burst_capacity > 0:
+                self.burst_key = burst_key
+                self.burst_remaining = self._claim_burst()
+        self.egress_bucket = _egress()
+
+    def _stored_burst(self, cache, now):
+        state = cache.get(self.burst_key)
+        if state is None:
+            return self.burst_capacity
+        tokens, updated = state
+        return min(self.burst_capacity, tokens + max(0.0, now - updated) * self.burst_rate)
+
+    def _store_burst(self, cache, tokens, now):
+        # Refilled completely by the time the entry expires
+        cache.set(self.burst_key, (tokens, now), math.ceil(settings.VIDEO_PACING_BURST_SECONDS) + 1)
+
+    def _claim_burst(self):
+        """Take all of the client's burst that is left"""
+        cache = caches[settings.VIDEO_PACING_BURST_CACHE]
+        now = time.time()
+        available = self._stored_burst(cache, now)
+        self._store_burst(cache, 0, now)
+        return int(available)
+
+    def close(self):
+        """Give back the burst this response didn't use"""
+        if self.burst_key is None or self.burst_remaining <= 0:
+            return
+        cache = caches[settings.VIDEO_PACING_BURST_CACHE]
+        now = time.time()
+        self._store_burst(cache, min(self.burst_capacity, self._stored_burst(cache, now) + self.burst_remaining), now)
+        self.burst_remaining = 0
+
+    def delay(self, amount):
+        """Account for sending `amount` bytes and return the seconds to wait first"""
+        burst = min(amount, self.burst_remaining)
+        self.burst_remaining -= burst
+        stream_wait = egress_wait = 0.0
+        if self.stream_bucket is not None and amount > burst:
+            stream_wait = self.stream_bucket.reserve(amount - burst)
+        if self.egress_bucket is not None:
+            egress_wait = self.egress_bucket.reserve(amount)
+        pacing_stats.add(
+            burst_bytes=burst,
+            paced_bytes=amount - burst,
+            stream_wait_seconds=stream_wait,
+            egress_wait_seconds=egress_wait,
+        )
+        return max(stream_wait, egress_wait)
+
+
+def _pieces(chunk, size):
+    """Split a chunk so large cached blocks are paced smoothly"""
+    if len(chunk) <= size:
+        return (chunk,)
+    view = memoryview(chunk)
+    return (view[start:start + size] for start in range(0, len(view), size))
+
+
+def paced(chunks, bitrate, burst_key=None):
+    """Wrap a byte-chunk iterator so it is sent no faster than the pacing limits"""
+    pacer = StreamPacer(bitrate, burst_key)
+    piece_size = settings.VIDEO_STREAM_CHUNK_SIZE
+    pacing_stats.add(streams=1, active_streams=1)
+    try:
+        for chunk in chunks:
+            for piece in _pieces(chunk, piece_size):
+                wait = pacer.delay(len(piece))
+                if wait > 0:
+                    time.sleep(wait)
+                yield piece
+    finally:
+        pacer.close()
+        pacing_stats.add(active_streams=-1)
+
+
+async def apaced(chunks, bitrate, burst_key=None):
+    """Async version of paced() for async byte-chunk iterators"""
+    pacer = await sync_to_async(StreamPacer, thread_sensitive=False)(bitrate, burst_key)
+    piece_size = settings.VIDEO_STREAM_CHUNK_SIZE
+    pacing_stats.add(streams=1, active_streams=1)
+    try:
+        async for chunk in chunks:
+            for piece in _pieces(chunk, piece_size):
+                wait = pacer.delay(len(piece))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                yield piece
+    finally:
+        await sync_to_async(pacer.close, thread_sensitive=False)()
+        pacing_stats.add(active_streams=-1)
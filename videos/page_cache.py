@@ -0,0 +1,100 @@
+"""
+Versioned caching of rendered pages and template fragments.
+
+Cache keys embed version numbers for the data they were rendered from:
+'videos' (any video's listing data), 'video:<id>' (one video and its
+comments) and 'related' (the precomputed related lists). Signals bump a
+version when its data changes, which orphans every key built on it
+without having to find and delete them. Only get/set/incr are used, so the
+locmem and file backends work as well as memcached or Redis.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+def _cache():
+    return caches[settings.VIDEO_PAGE_CACHE_ALIAS]
+
+
+def _version_key(scope):
+    return f'page-version:{scope}'
+
+
+def versions(*scopes):
+    """Current version string for the given scopes"""
+    cache = _cache()
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: _initial_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return '.'.join(str(found[key]) for key in keys)
+
+
+def _initial_version():
+    # Time-based, so a version key that was evicted never comes back with a
+    # number that old entries were stored under
+    return int(time.time() * 1000)
+
+
+def bump(*scopes):
+    """Invalidate everything cached under the given scopes"""
+    cache = _cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            cache.set(_version_key(scope), _initial_version(), None)
+
+
+def invalidate_video(video_id):
+    bump('videos', f'video:{video_id}')
+
+
+def _cacheable(request):
+    """Anonymous GETs without pending flash messages all see the same page"""
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    if 'messages' in request.COOKIES:
+        return False
+    session = getattr(request, 'session', None)
+    return session is None or not session.get('_messages')
+
+
+def cache_anonymous_page(scopes, on_hit=None):
+    """Cache a view's whole response for anonymous visitors.
+
+    `scopes(**view_kwargs)` names the version scopes the page depends on;
+    `on_hit(request, **view_kwargs)` runs side effects that must still
+    happen when the page comes from the cache, such as counting a view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            timeout = settings.VIDEO_PAGE_CACHE_TTL
+            if not timeout or not _cacheable(request):
+                return view(request, *args, **kwargs)
+
+            path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = f'page:{view.__name__}:{versions(*scopes(**kwargs))}:{path_hash}'
+            cache = _cache()
+            cached = cache.get(key)
+            if cached is not None:
+                if on_hit is not None:
+                    on_hit(request, **kwargs)
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                cache.set(key, (response.content, response['Content-Type']), timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,109 @@
+"""
+Keyset (cursor) pagination for the video feeds
+"""
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class KeysetPage:
+    """One page of a feed ordered newest first on (`field`, id).
+
+    Pages are fetched with `field <= x` range conditions, so each is a
+    single index range scan no matter how deep it is, and no COUNT query is
+    needed. `next_cursor` and `previous_cursor` are signed opaque tokens.
+    The query runs on first use, so a page rendered inside a cached template
+    fragment costs nothing on a cache hit.
+    """
+
+    salt = 'videos.pagination.feed'
+
+    def __init__(self, queryset, cursor=None, per_page=12, field='uploaded_at'):
+        self.queryset = queryset
+        self.cursor = cursor
+        self.per_page = per_page
+        self.field = field
+
+    @cached_property
+    def _page(self):
+        """(object_list, has_previous, has_next)"""
+        per_page = self.per_page
+        direction, position = self._decode(self.cursor)
+        if direction == 'previous':
+            rows = list(self._before(self.queryset, position)[:per_page + 1])
+            object_list, has_previous, has_next = rows[:per_page][::-1], len(rows) > per_page, True
+        else:
+            queryset = self.queryset if position is None else self._after(self.queryset, position)
+            rows = list(queryset.order_by(f'-{self.field}', '-id')[:per_page + 1])
+            object_list, has_previous, has_next = rows[:per_page], position is not None, len(rows) > per_page
+        if not object_list:
+            has_previous = has_next = False
+        return object_list, has_previous, has_next
+
+    @property
+    def object_list(self):
+        return self._page[0]
+
+    @property
+    def has_previous(self):
+        return self._page[1]
+
+    @property
+    def has_next(self):
+        return self._page[2]
+
+    @property
+    def next_cursor(self):
+        return self._encode('next', self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self._encode('previous', self.object_list[0]) if self.has_previous else None
+
+    def _after(self, queryset, position):
+        """Rows that come after `position` in newest-first order"""
+        value, pk = position
+        return queryset.filter(**{f'{self.field}__lte': value}).exclude(**{self.field: value, 'id__gte': pk})
+
+    def _before(self, queryset, position):
+        """Rows that come before `position`, nearest first"""
+        value, pk = position
+        return (
+            queryset.filter(**{f'{self.field}__gte': value})
+            .exclude(**{self.field: value, 'id__lte': pk})
+            .order_by(self.field, 'id')
+        )
+
+    def _encode(self, direction, obj):
+        return signing.dumps([direction, self.field, getattr(obj, self.field).isoformat(), obj.id], salt=self.salt)
+
+    def _decode(self, cursor):
+        """Return (direction, (value, id)); bad or missing cursors mean the first page"""
+        if not cursor:
+            return 'next', None
+        try:
+            direction, field, value, pk = signing.loads(cursor, salt=self.salt)
+            value = parse_datetime(value)
+        except (signing.BadSignature, TypeError, ValueError):
+            return 'next', None
+        if direction not in ('next', 'previous') or field != self.field or value is None or not isinstance(pk, int):
+            return 'next', None
+        return direction, (value, pk)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def approximate_count(queryset, key):
+    """COUNT(*) of a feed, cached for VIDEO_FEED_COUNT_TTL seconds"""
+    return cache.get_or_set(f'feed-count:{key}', queryset.count, settings.VIDEO_FEED_COUNT_TTL)
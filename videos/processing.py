@@ -0,0 +1,378 @@
+"""
+Media processing stages run on new uploads
+"""
+
+import logging
+import os
+import shutil
+
+import ffmpeg
+from django.conf import settings
+
+from . import jobs, page_cache
+from .artwork import generate_artwork
+from .models import Video, VideoRendition
+from .related import compute_related_for_video
+from .storage import media_storage
+
+logger = logging.getLogger(__name__)
+
+# Containers that can be remuxed with the moov atom up front
+FASTSTART_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+
+
+def queue_processing(video):
+    """Queue the processing pipeline for a saved upload; a run_worker process picks it up"""
+    jobs.enqueue('process_video', video.id, key=f'process_video:{video.id}')
+
+
+def process_video(video_id):
+    """Processing pipeline for a newly uploaded video"""
+    try:
+        video = Video.objects.get(id=video_id)
+    except Video.DoesNotExist:
+        return
+
+    faststart = os.path.splitext(video.video_file.name)[1].lower() in FASTSTART_EXTENSIONS
+    if faststart:
+        report_progress(video, 5, 'Optimizing for streaming')
+        make_faststart(video)
+
+    # Unless the remux already stored a new blob
+    report_progress(video, 8, 'Storing upload')
+    address_media(video)
+
+    # After the remux, which changes the file size
+    report_progress(video, 10, 'Reading media information')
+    probe_video(video)
+
+    if faststart:
+        report_progress(video, 15, 'Indexing keyframes')
+        build_keyframe_index(video)
+
+    # Before HLS, which takes longest, so the video gets its poster early
+    if settings.VIDEO_ARTWORK_ENABLED:
+        report_progress(video, 25, 'Generating thumbnails')
+        generate_artwork(video)
+
+    if settings.VIDEO_HLS_ENABLED:
+        package_hls(video, progress=lambda done, total, name: report_progress(
+            video, 40 + 55 * done // total, f'Transcoding {name}'
+        ))
+
+    # Give the new video its related list now, scored against likely
+    # candidates only; the periodic full run covers every other video
+    report_progress(video, 95, 'Finding related videos')
+    compute_related_for_video(video)
+
+    Video.objects.filter(id=video.id).update(processing_status=Video.READY, processing_progress=100, processing_stage='')
+    page_cache.invalidate_video(video.id)
+
+
+def report_progress(video, percent, stage):
+    """Show how far processing has got, and renew the running job's lease"""
+    Video.objects.filter(id=video.id).update(
+        processing_status=Video.PROCESSING, processing_progress=percent, processing_stage=stage
+    )
+    jobs.heartbeat()
+
+
+def processing_failed(video_id):
+    """Called once the process_video job has run out of attempts"""
+    Video.objects.filter(id=video_id).update(processing_status=Video.FAILED, processing_stage='Processing failed')
+
+
+def probe_video(video):
+    """Store the file size, duration, bitrate, resolution and codecs of a video.
+
+    Listings and the stream endpoint read these columns instead of statting
+    or probing the file. The size is kept even when ffprobe fails.
+    """
+    try:
+        file_size = os.path.getsize(video.video_file.path)
+    except OSError as exc:
+        logger.error('Cannot read the size of video %s: %s', video.id, exc)
+        return False
+    try:
+        probe = ffmpeg.probe(video.video_file.path)
+    except (ffmpeg.Error, OSError) as exc:
+        logger.error('Cannot probe video %s: %s', video.id, _error_text(exc))
+        probe = {}
+
+    fields = media_info(probe, file_size)
+    for name, value in fields.items():
+        setattr(video, name, value)
+    video.save(update_fields=list(fields))
+    return bool(probe)
+
+
+def media_info(probe, file_size):
+    """Video model fields from ffprobe output"""
+    streams = probe.get('streams', [])
+    video_stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio_stream = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    container = probe.get('format', {})
+    duration = _number(container.get('duration'), float)
+    bitrate = _number(container.get('bit_rate'), int)
+    if bitrate is None and duration:
+        bitrate = int(file_size * 8 / duration)
+    return {
+        'file_size': file_size,
+        'duration': duration,
+        'bitrate': bitrate,
+        'width': _number(video_stream.get('width'), int),
+        'height': _number(video_stream.get('height'), int),
+        'video_codec': video_stream.get('codec_name', '')[:32],
+        'audio_codec': audio_stream.get('codec_name', '')[:32],
+    }
+
+
+def _number(value, kind):
+    """ffprobe reports numbers as strings, and 'N/A' when it can't tell"""
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _top_level_atoms(path):
+    """Yield the types of the top-level atoms in an MP4/QuickTime file"""
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 8 <= file_size:
+            f.seek(position)
+            header = f.read(16)
+            size = int.from_bytes(header[:4], 'big')
+            atom_type = header[4:8]
+            if size == 1:
+                size = int.from_bytes(header[8:16], 'big')
+            elif size == 0:
+                size = file_size - position
+            if size < 8:
+                return
+            yield atom_type
+            position += size
+
+
+def needs_faststart(path):
+    """True if the file's mdat atom comes before its moov atom"""
+    for atom_type in _top_level_atoms(path):
+        if atom_type == b'moov':
+            return False
+        if atom_type == b'mdat':
+            return True
+    return False
+
+
+def make_faststart(video):
+    """Remux an MP4/MOV upload so the moov atom precedes the media data.
+
+    Browsers can then start playback from the first bytes instead of
+    range-fetching the tail of the file first. Streams are copied, not
+    re-encoded. Stored files are immutable and may be shared, so the result
+    is stored as a new blob and the video repointed at it.
+    """
+    source_path = video.video_file.path
+    try:
+        if not needs_faststart(source_path):
+            return False
+    except OSError:
+        return False
+
+    descriptor, tmp_path = media_storage.temporary_file(suffix=os.path.splitext(source_path)[1])
+    os.close(descriptor)
+    try:
+        (
+            ffmpeg
+            .input(source_path)
+            .output(tmp_path, c='copy', map=0, movflags='+faststart')
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except (ffmpeg.Error, OSError) as exc:
+        logger.error('Cannot remux video %s to fast-start: %s', video.id, _error_text(exc))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    video.video_file.name = media_storage.adopt(tmp_path, video.video_file.name)
+    # The save signals move the file reference and drop cached stream metadata
+    video.save(update_fields=['video_file'])
+    return True
+
+
+def address_media(video):
+    """Move the video's uploaded files to blobs named by their content.
+
+    Uploads are stored unhashed so the request returns without reading
+    them back; hashing here lets identical uploads share one blob. A file
+    that cannot be hashed keeps its unhashed name and still plays.
+    """
+    fields = []
+    for field in ('video_file', 'thumbnail'):
+        file = getattr(video, field)
+        if not file or not media_storage.is_incoming(file.name):
+            continue
+        try:
+            file.name = media_storage.address(file.name)
+        except OSError as exc:
+            logger.error('Cannot store %s of video %s by content: %s', field, video.id, exc)
+            continue
+        fields.append(field)
+    if fields:
+        # The save signals move the file references; the unhashed files are
+        # deleted once nothing else, such as the upload session, holds them
+        video.save(update_fields=fields)
+
+
+def build_keyframe_index(video):
+    """Record the byte offset of every video keyframe on the Video.
+
+    Lets seeks be mapped onto ranges that start on a keyframe. Must run
+    after make_faststart, since remuxing moves the media data.
+    """
+    try:
+        probe = ffmpeg.probe(
+            video.video_file.path,
+            select_streams='v:0',
+            show_packets=None,
+            show_entries='packet=pts_time,pos,flags',
+        )
+    except (ffmpeg.Error, OSError) as exc:
+        logger.error('Cannot index keyframes of video %s: %s', video.id, _error_text(exc))
+        return
+
+    keyframes = []
+    for packet in probe.get('packets', []):
+        if 'K' not in packet.get('flags', ''):
+            continue
+        try:
+            keyframes.append((float(packet['pts_time']), int(packet['pos'])))
+        except (KeyError, ValueError):
+            continue
+
+    video.set_keyframe_index(keyframes)
+    video.save(update_fields=['keyframe_index'])
+
+
+def _source_dimensions(path):
+    """Return (width, height) of the first video stream in `path`"""
+    probe = ffmpeg.probe(path)
+    stream = next(s for s in probe['streams'] if s.get('codec_type') == 'video')
+    return int(stream['width']), int(stream['height'])
+
+
+def _ladder_for(source_height):
+    """Ladder rungs no taller than the source, keeping at least the smallest"""
+    ladder = sorted(settings.VIDEO_HLS_LADDER, key=lambda rung: rung[1], reverse=True)
+    rungs = [rung for rung in ladder if rung[1] <= source_height]
+    return rungs or ladder[-1:]
+
+
+def package_hls(video, progress=None):
+    """Transcode a video into the HLS rendition ladder.
+
+    Each rendition is written to MEDIA_ROOT/hls/<video id>/<name>/ as a VOD
+    playlist plus MPEG-TS segments, with keyframes forced on segment
+    boundaries so players can switch rungs cleanly. The master playlist is
+    rewritten after every rendition so playback can start on the rungs that
+    are already done. `progress(done, total, name)` is called before each
+    rendition is transcoded.
+    """
+    source_path = video.video_file.path
+    output_root = os.path.join(settings.MEDIA_ROOT, video.hls_dir)
+    shutil.rmtree(output_root, ignore_errors=True)
+
+    VideoRendition.objects.filter(video=video).delete()
+    if video.width and video.height:
+        source_width, source_height = video.width, video.height
+    else:
+        try:
+            source_width, source_height = _source_dimensions(source_path)
+        except (ffmpeg.Error, OSError, StopIteration, KeyError, ValueError) as exc:
+            logger.error('Cannot package video %s for HLS: %s', video.id, _error_text(exc))
+            return
+
+    renditions = []
+    for name, height, video_bitrate in _ladder_for(source_height):
+        # Keep the source aspect ratio with an even width for libx264
+        width = int(round(source_width * height / source_height / 2)) * 2
+        renditions.append(VideoRendition.objects.create(
+            video=video, name=name, width=width, height=height, video_bitrate=video_bitrate
+        ))
+
+    segment_seconds = settings.VIDEO_HLS_SEGMENT_SECONDS
+    for done, rendition in enumerate(renditions):
+        if progress is not None:
+            progress(done, len(renditions), rendition.name)
+        rendition.status = VideoRendition.PROCESSING
+        rendition.save(update_fields=['status', 'updated_at'])
+
+        output_dir = os.path.join(output_root, rendition.name)
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            (
+                ffmpeg
+                .input(source_path)
+                .output(
+                    os.path.join(output_dir, 'index.m3u8'),
+                    vf=f'scale={rendition.width}:{rendition.height}',
+                    vcodec='libx264',
+                    preset='veryfast',
+                    acodec='aac',
+                    force_key_frames=f'expr:gte(t,n_forced*{segment_seconds})',
+                    format='hls',
+                    hls_time=segment_seconds,
+                    hls_playlist_type='vod',
+                    hls_segment_filename=os.path.join(output_dir, 'segment_%05d.ts'),
+                    **{
+                        'b:v': f'{rendition.video_bitrate}k',
+                        'maxrate': f'{int(rendition.video_bitrate * 1.07)}k',
+                        'bufsize': f'{rendition.video_bitrate * 2}k',
+                        'b:a': '128k',
+                    }
+                )
+                .overwrite_output()
+                .run(quiet=True)
+            )
+        except (ffmpeg.Error, OSError) as exc:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            rendition.status = VideoRendition.FAILED
+            rendition.error = _error_text(exc)
+        else:
+            rendition.status = VideoRendition.READY
+            rendition.error = ''
+        rendition.save(update_fields=['status', 'error', 'updated_at'])
+
+        write_master_playlist(video, renditions, output_root)
+
+
+def write_master_playlist(video, renditions, output_root):
+    """Write master.m3u8 listing the renditions that are ready"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in renditions:
+        if rendition.status != VideoRendition.READY:
+            continue
+        # Peak bandwidth including the 128k audio track
+        bandwidth = (int(rendition.video_bitrate * 1.07) + 128) * 1000
+        lines.append(
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},'
+            f'RESOLUTION={rendition.width}x{rendition.height}'
+        )
+        lines.append(rendition.playlist_name)
+
+    master_path = os.path.join(output_root, 'master.m3u8')
+    tmp_path = master_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, master_path)
+
+
+def _error_text(exc):
+    """Readable error for the rendition row, preferring ffmpeg's stderr"""
+    stderr = getattr(exc, 'stderr', None)
+    if stderr:
+        return stderr.decode('utf-8', 'replace')[-2000:]
+    return str(exc)
@@ -0,0 +1,173 @@
+"""
+Per-request database query accounting: budgets, N+1 detection and samples
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists and literals vary between otherwise identical queries
+_PLACEHOLDER_LIST_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\d+')
+_SPACE_RE = re.compile(r'\s+')
+# Transaction control repeats once per atomic block, which isn't an N+1
+_TRANSACTION_RE = re.compile(r'\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+
+_sample_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than its budget, or repeated one query shape too often"""
+
+
+def query_shape(sql):
+    """SQL with literals and IN-list lengths normalised away"""
+    shape = _PLACEHOLDER_LIST_RE.sub('(%s, ...)', sql)
+    shape = _STRING_RE.sub("'?'", shape)
+    shape = _NUMBER_RE.sub('N', shape)
+    return _SPACE_RE.sub(' ', shape).strip()
+
+
+class QueryRecorder:
+    """connection.execute_wrapper that counts and times queries by shape"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def duplicates(self, threshold):
+        """[(shape, count)] of shapes run at least `threshold` times, most repeated first"""
+        if not threshold:
+            return []
+        return [
+            (shape, count) for shape, count in self.shapes.most_common()
+            if count >= threshold and not _TRANSACTION_RE.match(shape)
+        ]
+
+
+class QueryBudgetMiddleware:
+    """Count the queries each request runs and flag the ones that run too many.
+
+    Budgets come from VIDEO_QUERY_BUDGETS (URL name -> max queries). A
+    request over its budget, or one that runs a single query shape
+    VIDEO_QUERY_DUPLICATE_THRESHOLD times or more (the N+1 signature), is
+    logged; with VIDEO_QUERY_BUDGET_STRICT it raises QueryBudgetExceeded,
+    which the test client re-raises so the test fails. Queries made while a
+    streaming body is iterated happen after the middleware returns and are
+    not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self._report(request, response, recorder)
+        return response
+
+    def _report(self, request, response, recorder):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else None) or 'unresolved'
+        budget = settings.VIDEO_QUERY_BUDGETS.get(view)
+        duplicates = recorder.duplicates(settings.VIDEO_QUERY_DUPLICATE_THRESHOLD)
+        over_budget = budget is not None and recorder.count > budget
+
+        metrics.registry.observe('videostream_db_queries_per_request', recorder.count, {'view': view})
+        metrics.registry.inc('videostream_db_query_seconds_total', {'view': view}, recorder.duration)
+
+        problems = []
+        if over_budget:
+            problems.append(f'{recorder.count} queries, budget {budget}')
+            metrics.registry.inc('videostream_db_query_budget_exceeded_total', {'view': view})
+        for shape, count in duplicates:
+            problems.append(f'{count}x {shape}')
+
+        offender = bool(problems)
+        rate = settings.VIDEO_QUERY_SAMPLE_RATE
+        if settings.VIDEO_QUERY_SAMPLE_FILE and (offender or (rate and random.random() < rate)):
+            _write_sample({
+                'time': time.time(),
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': recorder.count,
+                'sql_ms': round(recorder.duration * 1000, 3),
+                'budget': budget,
+                'over_budget': over_budget,
+                'duplicates': [{'shape': shape, 'count': count} for shape, count in duplicates],
+            })
+
+        if offender:
+            message = f'{request.method} {request.path} ({view}): ' + '; '.join(problems)
+            if settings.VIDEO_QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Query budget: %s', message)
+
+
+def _write_sample(sample):
+    """Append one JSON line; O_APPEND keeps lines from several workers whole"""
+    line = (json.dumps(sample) + '\n').encode()
+    with _sample_lock:
+        descriptor = os.open(settings.VIDEO_QUERY_SAMPLE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(descriptor, line)
+        finally:
+            os.close(descriptor)
+
+
+def summarize_samples(lines):
+    """Aggregate JSON-lines samples per view: query counts, SQL time and top duplicates"""
+    views = defaultdict(lambda: {'queries': [], 'sql_ms': [], 'over_budget': 0, 'duplicates': Counter()})
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        sample = json.loads(line)
+        view = views[sample['view']]
+        view['queries'].append(sample['queries'])
+        view['sql_ms'].append(sample['sql_ms'])
+        view['over_budget'] += bool(sample['over_budget'])
+        for duplicate in sample['duplicates']:
+            view['duplicates'][duplicate['shape']] += 1
+
+    summary = {}
+    for name, view in sorted(views.items()):
+        queries, sql_ms = sorted(view['queries']), sorted(view['sql_ms'])
+        summary[name] = {
+            'samples': len(queries),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': queries[-1],
+            'sql_ms_mean': round(sum(sql_ms) / len(sql_ms), 3),
+            'sql_ms_p95': sql_ms[min(len(sql_ms) - 1, int(len(sql_ms) * 0.95))],
+            'over_budget': view['over_budget'],
+            'duplicates': [
+                {'shape': shape, 'samples': count} for shape, count in view['duplicates'].most_common(5)
+            ],
+        }
+    return summary
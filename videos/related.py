@@ -0,0 +1,185 @@
+"""
+Precompute related videos from text similarity, co-views and uploader
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from . import page_cache
+from .models import RelatedVideo, Video, VideoCoView
+
+TOKEN_RE = re.compile(r'[^\W\d_]{2,}', re.UNICODE)
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has how in is it its of on or that the this to was were will with '
+    'you your my our we video videos'.split()
+)
+
+# Rows of the similarity matrix computed at once; bounds memory to BLOCK x videos floats
+BLOCK_SIZE = 256
+# A new video's most frequent terms, used to find the videos it is scored against
+CANDIDATE_TERMS = 8
+
+
+def _tokens(video):
+    """Title words count twice, so they outweigh description words"""
+    title = [word for word in TOKEN_RE.findall(video.title.lower()) if word not in STOP_WORDS]
+    description = [word for word in TOKEN_RE.findall(video.description.lower()) if word not in STOP_WORDS]
+    return Counter(title * 2 + description)
+
+
+def tfidf_matrix(videos, max_features):
+    """L2-normalised TF-IDF rows (float32), one per video, over the most common terms"""
+    counts = [_tokens(video) for video in videos]
+    document_frequency = Counter(term for terms in counts for term in terms)
+    vocabulary = {
+        term: column
+        for column, (term, _) in enumerate(document_frequency.most_common(max_features))
+    }
+    matrix = np.zeros((len(videos), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, terms in enumerate(counts):
+        for term, count in terms.items():
+            column = vocabulary.get(term)
+            if column is not None:
+                matrix[row, column] = 1 + math.log(count)
+    idf = np.zeros(matrix.shape[1], dtype=np.float32)
+    for term, column in vocabulary.items():
+        idf[column] = math.log((1 + len(videos)) / (1 + document_frequency[term])) + 1
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def coview_scores(ids, coviews=None):
+    """Co-view counts normalised like a cosine: n(a, b) / sqrt(n(a) * n(b))"""
+    position = {video_id: index for index, video_id in enumerate(ids)}
+    pairs = defaultdict(dict)
+    totals = Counter()
+    coviews = VideoCoView.objects.all() if coviews is None else coviews
+    for first, second, count in coviews.values_list('video_id', 'other_id', 'count').iterator():
+        if first in position and second in position and count:
+            pairs[first][second] = count
+            pairs[second][first] = count
+            totals[first] += count
+            totals[second] += count
+    return {
+        video_id: {other: count / math.sqrt(totals[video_id] * totals[other]) for other, count in others.items()}
+        for video_id, others in pairs.items()
+    }, position
+
+
+def compute_related(video_ids=None, top_k=None):
+    """Rebuild RelatedVideo rows for `video_ids` (default: every public video).
+
+    Candidates are all public videos; each score is the weighted sum of
+    TF-IDF cosine similarity, normalised co-views and a same-uploader bonus
+    (VIDEO_RELATED_WEIGHTS). Returns the number of videos updated.
+    """
+    videos = list(Video.objects.filter(is_public=True).only('id', 'title', 'description', 'uploader_id').order_by('id'))
+    if not videos:
+        return 0
+    ids = [video.id for video in videos]
+    coviews, position = coview_scores(ids)
+    if video_ids is None:
+        rows = range(len(videos))
+    else:
+        rows = sorted(position[video_id] for video_id in set(video_ids) if video_id in position)
+    results = _rank(videos, rows, coviews, position, top_k)
+    _save(results, replace_all=video_ids is None)
+    return len(results)
+
+
+def candidates(video, limit):
+    """Up to `limit` public videos worth scoring against `video`, newest first.
+
+    Those from the same uploader, those co-viewed with it and those sharing
+    one of its most frequent title or description terms.
+    """
+    terms = [term for term, _ in _tokens(video).most_common(CANDIDATE_TERMS)]
+    related = [
+        Q(uploader_id=video.uploader_id),
+        Q(id__in=VideoCoView.objects.filter(video_id=video.id).values('other_id')),
+        Q(id__in=VideoCoView.objects.filter(other_id=video.id).values('video_id')),
+    ]
+    related += [Q(title__icontains=term) | Q(description__icontains=term) for term in terms]
+    return list(
+        Video.objects.filter(reduce(or_, related), is_public=True).exclude(id=video.id)
+        .only('id', 'title', 'description', 'uploader_id').order_by('-id')[:limit]
+    )
+
+
+def compute_related_for_video(video, top_k=None):
+    """Give a new video its related list without scoring it against every video.
+
+    Only candidates() are scored, so TF-IDF weights come from that sample;
+    the periodic full compute_related run recomputes every list over all
+    public videos, including this one. Returns the number of videos updated.
+    """
+    if not video.is_public:
+        return 0
+    videos = [video] + candidates(video, settings.VIDEO_RELATED_CANDIDATES)
+    ids = [candidate.id for candidate in videos]
+    coviews, position = coview_scores(
+        ids, VideoCoView.objects.filter(Q(video_id=video.id) | Q(other_id=video.id), video_id__in=ids, other_id__in=ids)
+    )
+    results = _rank(videos, [0], coviews, position, top_k)
+    _save(results)
+    return len(results)
+
+
+def _rank(videos, rows, coviews, position, top_k=None):
+    """{video id: [(related id, score), ...]} for videos[row] of each row, scored against all `videos`"""
+    top_k = top_k or settings.VIDEO_RELATED_COUNT
+    weights = settings.VIDEO_RELATED_WEIGHTS
+    ids = np.array([video.id for video in videos])
+    uploaders = np.array([video.uploader_id for video in videos])
+    matrix = tfidf_matrix(videos, settings.VIDEO_RELATED_MAX_FEATURES)
+    rows = np.array(rows, dtype=int)
+    k = min(top_k, len(videos) - 1)
+
+    results = {}
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        scores = weights['text'] * (matrix[block] @ matrix.T)
+        scores += weights['uploader'] * (uploaders[block][:, None] == uploaders[None, :])
+        for offset, row in enumerate(block):
+            for other, score in coviews.get(int(ids[row]), {}).items():
+                scores[offset, position[other]] += weights['coview'] * score
+            scores[offset, row] = -np.inf
+        if k <= 0:
+            best = np.empty((len(block), 0), dtype=int)
+        else:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for offset, row in enumerate(block):
+            columns = best[offset][np.argsort(-scores[offset, best[offset]], kind='stable')]
+            results[int(ids[row])] = [
+                (int(ids[column]), float(scores[offset, column]))
+                for column in columns if scores[offset, column] > 0
+            ]
+    return results
+
+
+def _save(results, replace_all=False):
+    with transaction.atomic():
+        if replace_all:
+            # Also drops rows of videos that were deleted or made private
+            RelatedVideo.objects.all().delete()
+        else:
+            RelatedVideo.objects.filter(video_id__in=list(results)).delete()
+        RelatedVideo.objects.bulk_create(
+            [
+                RelatedVideo(video_id=video_id, related_id=related_id, rank=rank, score=score)
+                for video_id, related in results.items()
+                for rank, (related_id, score) in enumerate(related)
+            ],
+            batch_size=1000,
+        )
+    page_cache.bump('related')
@@ -0,0 +1,252 @@
+"""
+Full-text search index for public videos.
+
+SQLite uses an FTS5 table and PostgreSQL a table of weighted tsvectors with a
+GIN index; both are keyed by video id and hold the title, description and
+uploader name of public videos. Other databases, or SQLite builds without
+FTS5, fall back to icontains filtering.
+"""
+
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Video
+
+# Markers placed around matches by the database; escaped text is then
+# given <mark> tags in their place
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+SearchHit = namedtuple('SearchHit', ['video_id', 'title', 'snippet'])
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(query):
+    return TERM_RE.findall(query.lower())[:16]
+
+
+def _clean(text):
+    return (text or '').replace(HIGHLIGHT_START, '').replace(HIGHLIGHT_END, '')
+
+
+def mark_highlights(text):
+    """Escape highlighted text from the index and turn the markers into <mark> tags"""
+    return mark_safe(
+        escape(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+    )
+
+
+class SQLiteBackend:
+    table = 'videos_video_fts'
+
+    def index(self, cursor, rows):
+        cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {self.table} (rowid, title, description, uploader) VALUES (%s, %s, %s, %s)', rows
+        )
+
+    def remove(self, cursor, video_ids):
+        cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(video_id,) for video_id in video_ids])
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {self.table}')
+
+    @staticmethod
+    def _match(terms):
+        # Every term must match, the last one as a prefix for search-as-you-type
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' AND '.join(quoted)
+
+    def ranked_ids(self, cursor, terms, limit):
+        cursor.execute(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+            f'ORDER BY bm25({self.table}, 10.0, 1.0, 4.0) LIMIT %s',
+            [self._match(terms), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def highlights(self, cursor, terms, video_ids):
+        placeholders = ', '.join(['%s'] * len(video_ids))
+        cursor.execute(
+            f"SELECT rowid, highlight({self.table}, 0, %s, %s), "
+            f"snippet({self.table}, 1, %s, %s, '…', 24) "
+            f'FROM {self.table} WHERE {self.table} MATCH %s AND rowid IN ({placeholders})',
+            [HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, self._match(terms), *video_ids],
+        )
+        return cursor.fetchall()
+
+
+class PostgresBackend:
+    table = 'videos_video_search'
+    document = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'C')"
+    )
+
+    def index(self, cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {self.table} (video_id, title, description, document) '
+            f'VALUES (%s, %s, %s, {self.document}) '
+            'ON CONFLICT (video_id) DO UPDATE SET title = EXCLUDED.title, '
+            'description = EXCLUDED.description, document = EXCLUDED.document',
+            [(video_id, title, description, title, uploader, description)
+             for video_id, title, description, uploader in rows],
+        )
+
+    def remove(self, cursor, video_ids):
+        cursor.execute(f'DELETE FROM {self.table} WHERE video_id = ANY(%s)', [list(video_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {self.table}')
+
+    @staticmethod
+    def _query(terms):
+        return ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+    def ranked_ids(self, cursor, terms, limit):
+        cursor.execute(
+            f"SELECT video_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC, video_id DESC LIMIT %s",
+            [self._query(terms), self._query(terms), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def highlights(self, cursor, terms, video_ids):
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}'
+        cursor.execute(
+            f"SELECT video_id, ts_headline('simple', title, to_tsquery('simple', %s), %s), "
+            f"ts_headline('simple', description, to_tsquery('simple', %s), %s) "
+            f'FROM {self.table} WHERE video_id = ANY(%s)',
+            [self._query(terms), f'{options}, HighlightAll=true', self._query(terms),
+             f'{options}, MaxWords=35, MinWords=15', list(video_ids)],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+_available = {}
+
+
+def forget_availability(**kwargs):
+    """Look for the index tables again, e.g. after migrations created them"""
+    _available.clear()
+
+
+def get_backend():
+    """The index backend for the default database, or None when searches must use LIKE"""
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return None
+    available = _available.get(connection.alias)
+    if available is None:
+        # SQLite may have been built without FTS5, leaving the migration a no-op
+        available = _available[connection.alias] = backend_class.table in connection.introspection.table_names()
+    return backend_class() if available else None
+
+
+def _document_rows(videos):
+    return [
+        (video.id, _clean(video.title), _clean(video.description), _clean(video.uploader.username))
+        for video in videos
+    ]
+
+
+def index_videos(videos):
+    """Add or refresh index entries; private videos are removed instead"""
+    backend = get_backend()
+    if backend is None:
+        return
+    videos = list(videos)
+    with connection.cursor() as cursor:
+        public = [video for video in videos if video.is_public]
+        private = [video.id for video in videos if not video.is_public]
+        if public:
+            backend.index(cursor, _document_rows(public))
+        if private:
+            backend.remove(cursor, private)
+
+
+def remove_videos(video_ids):
+    backend = get_backend()
+    if backend is None or not video_ids:
+        return
+    with connection.cursor() as cursor:
+        backend.remove(cursor, list(video_ids))
+
+
+def rebuild_index(batch_size=500):
+    """Re-index every public video. Returns the number indexed."""
+    backend = get_backend()
+    if backend is None:
+        return 0
+    count = 0
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+    videos = Video.objects.filter(is_public=True).select_related('uploader').order_by('id')
+    batch = []
+    for video in videos.iterator(chunk_size=batch_size):
+        batch.append(video)
+        if len(batch) >= batch_size:
+            index_videos(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        index_videos(batch)
+        count += len(batch)
+    return count
+
+
+def search_video_ids(query):
+    """Ids of public videos matching `query`, best match first.
+
+    Returns None when no full-text index is available; callers then use
+    fallback_filter().
+    """
+    backend = get_backend()
+    if backend is None:
+        return None
+    terms = search_terms(query)
+    if not terms:
+        return []
+    with connection.cursor() as cursor:
+        return backend.ranked_ids(cursor, terms, settings.VIDEO_SEARCH_MAX_RESULTS)
+
+
+def highlight_videos(query, videos):
+    """Set `search_title` and `search_snippet` (safe HTML) on videos found by search_video_ids()"""
+    backend = get_backend()
+    terms = search_terms(query)
+    if backend is None or not terms or not videos:
+        return
+    with connection.cursor() as cursor:
+        hits = {
+            row[0]: SearchHit(*row)
+            for row in backend.highlights(cursor, terms, [video.id for video in videos])
+        }
+    for video in videos:
+        hit = hits.get(video.id)
+        if hit is not None:
+            video.search_title = mark_highlights(hit.title)
+            video.search_snippet = mark_highlights(hit.snippet) if HIGHLIGHT_START in hit.snippet else None
+
+
+def fallback_filter(queryset, query):
+    """LIKE-based filtering used when the database has no full-text index"""
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(uploader__username__icontains=query)
+    )
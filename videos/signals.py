@@ -0,0 +1,123 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from django.contrib.auth.models import User
+
+from . import blobs, jobs, page_cache, search
+from .block_cache import block_cache
+from .models import Comment, UploadSession, Video
+from .storage import media_storage
+from .stream_cache import stream_meta_cache
+
+# File fields whose stored files are reference counted in MediaBlob
+MEDIA_FIELDS = {
+    Video: ('video_file', 'thumbnail'),
+    UploadSession: ('thumbnail',),
+}
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def invalidate_stream_meta(sender, instance, **kwargs):
+    """Drop cached stream metadata when a video changes or goes away"""
+    stream_meta_cache.invalidate(instance.id)
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=UploadSession)
+def remember_stored_media(sender, instance, update_fields=None, **kwargs):
+    """Note which files the row referenced before this save"""
+    fields = MEDIA_FIELDS[sender]
+    if update_fields is not None and not set(fields) & set(update_fields):
+        instance._stored_media = None
+    elif instance._state.adding:
+        instance._stored_media = []
+    else:
+        instance._stored_media = list(sender.objects.filter(pk=instance.pk).values_list(*fields).first() or [])
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=UploadSession)
+def count_media_references(sender, instance, **kwargs):
+    """Move references from the files a save replaced to the ones it set"""
+    stored = getattr(instance, '_stored_media', None)
+    if stored is None:
+        return
+    current = Counter(getattr(instance, field).name for field in MEDIA_FIELDS[sender])
+    stored = Counter(stored)
+    blobs.retain((current - stored).elements())
+    blobs.release((stored - current).elements())
+    _forget_blocks(stored - current)
+    instance._stored_media = None
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=UploadSession)
+def release_media(sender, instance, **kwargs):
+    """Deleting the last reference to a file deletes the file"""
+    names = [getattr(instance, field).name for field in MEDIA_FIELDS[sender]]
+    blobs.release(names)
+    _forget_blocks(names)
+
+
+def _forget_blocks(names):
+    """Drop this process's cached blocks of files a row stopped pointing at"""
+    for name in names:
+        if name:
+            block_cache.invalidate(media_storage.path(name))
+
+
+@receiver(post_delete, sender=Video)
+def delete_generated_media(sender, instance, **kwargs):
+    """Queue removal of the HLS and artwork directories, also when a user deletion cascades"""
+    jobs.enqueue('delete_media', [instance.hls_dir, instance.artwork_dir], delay=settings.VIDEO_MEDIA_DELETE_DELAY)
+
+
+@receiver(post_save, sender=Video)
+def index_video(sender, instance, raw=False, **kwargs):
+    """Keep the search index in step with a video's text and visibility"""
+    if not raw:
+        search.index_videos([instance])
+
+
+@receiver(post_delete, sender=Video)
+def unindex_video(sender, instance, **kwargs):
+    search.remove_videos([instance.id])
+
+
+@receiver(post_save, sender=User)
+def reindex_uploader_videos(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    """Uploader names are indexed and shown in listings, so refresh them when one may have changed"""
+    if raw or created or (update_fields is not None and 'username' not in update_fields):
+        return
+    search.index_videos(Video.objects.filter(uploader=instance).select_related('uploader'))
+    page_cache.bump('videos')
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def invalidate_video_pages(sender, instance, **kwargs):
+    """Orphan cached pages and fragments that show this video"""
+    page_cache.invalidate_video(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    page_cache.bump(f'video:{instance.video_id}')
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created=False, raw=False, **kwargs):
+    """Keep Video.comment_count in step without a COUNT on every page view"""
+    if created and not raw:
+        Video.objects.filter(id=instance.video_id).update(comment_count=F('comment_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    Video.objects.filter(id=instance.video_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
@@ -0,0 +1,101 @@
+"""
+Content-addressed storage for uploaded media
+"""
+
+import hashlib
+import os
+import tempfile
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+READ_SIZE = 1024 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names every file after the SHA-256 of its content.
+
+    Uploads are first stored unhashed under blobs/incoming/, so a request
+    never reads a file back; the processing job then calls address(),
+    which hashes the file and links it to blobs/<aa>/<bb>/<sha256><ext>.
+    When that blob already exists the existing name is returned, so
+    identical uploads share one file, and the block cache, which is keyed
+    by path, serves them all from the same entries. Blobs are never
+    modified; how many fields point at each is tracked by videos.blobs.
+    """
+
+    prefix = 'blobs'
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks a unique name itself
+        return name
+
+    def _save(self, name, content):
+        # Temporary uploads are moved, not copied, by FileSystemStorage
+        return super()._save(self.incoming_name(name), content)
+
+    def incoming_name(self, name_hint):
+        """Unique name for a file stored before its content is hashed"""
+        extension = os.path.splitext(name_hint)[1].lower()
+        return f'{self.prefix}/incoming/{uuid.uuid4().hex}{extension}'
+
+    def is_incoming(self, name):
+        return name.startswith(f'{self.prefix}/incoming/')
+
+    def ingest(self, path, name_hint):
+        """Hard-link a file already on this filesystem into the store unhashed; returns its name"""
+        name = self.incoming_name(name_hint)
+        target = self.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.link(path, target)
+        if self.file_permissions_mode is not None:
+            os.chmod(target, self.file_permissions_mode)
+        return name
+
+    def address(self, name):
+        """Name of the blob with the same content as stored file `name`.
+
+        The file at `name` is left in place for its references to release.
+        """
+        descriptor, link_path = self.temporary_file()
+        os.close(descriptor)
+        os.remove(link_path)
+        os.link(self.path(name), link_path)
+        return self.adopt(link_path, name)
+
+    def adopt(self, path, name_hint):
+        """Move a file already on this filesystem into the store; returns its blob name"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                digest.update(block)
+        return self._place(path, digest.hexdigest(), name_hint)
+
+    def blob_name(self, sha256, name_hint):
+        """Name of the blob holding content with this hash; the extension comes from `name_hint`"""
+        extension = os.path.splitext(name_hint)[1].lower()
+        return f'{self.prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+    def temporary_file(self, suffix=''):
+        """(descriptor, path) of a new file on the blobs' filesystem, for adopt()"""
+        temp_dir = self.path(os.path.join(self.prefix, 'tmp'))
+        os.makedirs(temp_dir, exist_ok=True)
+        return tempfile.mkstemp(suffix=suffix, dir=temp_dir)
+
+    def _place(self, temp_path, sha256, name_hint):
+        name = self.blob_name(sha256, name_hint)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # Already stored: keep the existing blob, whose inode caches may know
+            os.remove(temp_path)
+        else:
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, path)
+        return name
+
+
+media_storage = ContentAddressedStorage()
@@ -0,0 +1,152 @@
+"""
+Per-video metadata cache for the stream endpoint
+"""
+
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+
+from .models import Video
+
+
+StreamMeta = namedtuple('StreamMeta', ['path', 'size', 'mtime', 'content_type', 'is_public', 'bitrate'])
+
+
+class StreamMetaCache:
+    """Process-local LRU with TTL mapping video id -> StreamMeta.
+
+    A player issues dozens of range requests per playback, so the database
+    lookup and the stat of the file are done once and reused until the entry
+    expires or is invalidated from Video save/delete. When
+    VIDEO_STREAM_META_CACHE_ALIAS names a Django cache, misses in the local
+    LRU fall through to it so workers can share entries.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        alias = settings.VIDEO_STREAM_META_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def _key(video_id):
+        return f'stream-meta:{video_id}'
+
+    def get_local(self, video_id):
+        """Look a video up in this process's LRU only"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                expires_at, meta = entry
+                if expires_at > now:
+                    self._entries.move_to_end(video_id)
+                    return meta
+                del self._entries[video_id]
+        return None
+
+    def get(self, video_id):
+        meta = self.get_local(video_id)
+        if meta is not None:
+            return meta
+
+        shared = self.shared
+        if shared is not None:
+            meta = shared.get(self._key(video_id))
+            if meta is not None:
+                meta = StreamMeta(*meta)
+                self._store(video_id, meta)
+                return meta
+        return None
+
+    def set(self, video_id, meta):
+        self._store(video_id, meta)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self._key(video_id), tuple(meta), settings.VIDEO_STREAM_META_CACHE_TTL)
+
+    def _store(self, video_id, meta):
+        expires_at = time.monotonic() + settings.VIDEO_STREAM_META_CACHE_TTL
+        with self._lock:
+            self._entries[video_id] = (expires_at, meta)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > settings.VIDEO_STREAM_META_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, video_id):
+        with self._lock:
+            self._entries.pop(video_id, None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete(self._key(video_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+stream_meta_cache = StreamMetaCache()
+
+
+def build_stream_meta(video):
+    """Stat a video's file and describe it for streaming"""
+    path = video.video_file.path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404("Video file not found")
+    content_type = mimetypes.guess_type(path)[0] or 'video/mp4'
+    return StreamMeta(path, stat.st_size, stat.st_mtime, content_type, video.is_public,
+                      _estimate_bitrate(video, stat.st_size))
+
+
+def _estimate_bitrate(video, file_size):
+    """Average bitrate in bits/s: the probed one, else estimated from the keyframe index, else None"""
+    if video.bitrate:
+        return video.bitrate
+    keyframes = video.get_keyframes()
+    if not keyframes or keyframes[-1][0] <= 0:
+        return None
+    return int(file_size * 8 / keyframes[-1][0])
+
+
+def get_stream_meta(video_id):
+    """Return the StreamMeta for a video, hitting the database only on a miss"""
+    meta = stream_meta_cache.get(video_id)
+    if meta is None:
+        try:
+            video = Video.objects.get(id=video_id)
+        except Video.DoesNotExist:
+            raise Http404("No Video matches the given query.")
+        meta = build_stream_meta(video)
+        stream_meta_cache.set(video_id, meta)
+    return meta
+
+
+async def aget_stream_meta(video_id):
+    """Async version of get_stream_meta for AsyncVideoStreamView"""
+    meta = stream_meta_cache.get_local(video_id)
+    if meta is None and settings.VIDEO_STREAM_META_CACHE_ALIAS:
+        # Django cache backends are synchronous
+        meta = await sync_to_async(stream_meta_cache.get, thread_sensitive=False)(video_id)
+    if meta is None:
+        try:
+            video = await Video.objects.aget(id=video_id)
+        except Video.DoesNotExist:
+            raise Http404("No Video matches the given query.")
+        meta = await sync_to_async(build_stream_meta, thread_sensitive=False)(video)
+        if settings.VIDEO_STREAM_META_CACHE_ALIAS:
+            await sync_to_async(stream_meta_cache.set, thread_sensitive=False)(video_id, meta)
+        else:
+            stream_meta_cache.set(video_id, meta)
+    return meta
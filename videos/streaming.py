@@ -0,0 +1,183 @@
+"""
+Helpers for serving video bytes from VideoStreamView
+"""
+
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.utils.http import parse_http_date_safe
+
+
+class RangeFileWrapper:
+    """File-like window onto `length` bytes of an open file starting at `offset`.
+
+    The wrapped file is positioned at `offset`, and `fileno()` is exposed so a
+    server's `wsgi.file_wrapper` (gunicorn) can hand the descriptor to
+    `os.sendfile` and serve the range kernel-side; gunicorn takes the offset
+    from the descriptor position and the byte count from Content-Length.
+    `read()` is capped at the end of the range so servers that iterate the
+    wrapper instead (wsgiref, runserver) never send more than was promised.
+    """
+
+    def __init__(self, file, offset=0, length=None):
+        self.file = file
+        self.remaining = length
+        self.file.seek(offset)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if self.remaining is None:
+            return self.file.read(size)
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested byte ranges overlap the file"""
+
+
+# Requests asking for more ranges than this are answered with the whole file
+MAX_RANGES = 32
+# ASCII only: str.isdigit() also accepts characters such as '²' that int() rejects
+DIGITS_RE = re.compile(r'[0-9]+')
+
+
+def parse_range_header(range_header, file_size):
+    """Parse a `Range: bytes=...` header against a file of `file_size` bytes.
+
+    Returns a sorted list of inclusive (start, end) pairs with overlapping
+    and adjacent ranges merged, or None when the header is malformed or uses
+    another unit, in which case RFC 7233 says to ignore it and send the full
+    representation. Raises RangeNotSatisfiable when the header is valid but
+    no range overlaps the file.
+    """
+    units, sep, spec = range_header.partition('=')
+    if not sep or units.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        start, end = start.strip(), end.strip()
+        if not sep or (start and not DIGITS_RE.fullmatch(start)) or (end and not DIGITS_RE.fullmatch(end)):
+            return None
+
+        if not start:
+            # Suffix range: the last N bytes
+            if not end:
+                return None
+            suffix = int(end)
+            if suffix > 0 and file_size > 0:
+                ranges.append((max(0, file_size - suffix), file_size - 1))
+            continue
+
+        first = int(start)
+        if end and int(end) < first:
+            return None
+        last = int(end) if end else file_size - 1
+        if first < file_size:
+            ranges.append((first, min(last, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(range_header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def file_etag(file_size, mtime):
+    """Strong ETag derived from the file's size and modification time"""
+    return f'"{file_size:x}-{int(mtime * 1000000):x}"'
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """Return True if a Range header should be honored given `If-Range`.
+
+    An entity tag must match exactly and be strong; a date must equal the
+    Last-Modified time. A missing header always matches.
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def multipart_segments(ranges, content_type, file_size, boundary):
+    """Lay out a multipart/byteranges body.
+
+    Returns a list whose items are either literal bytes (part headers and
+    delimiters) or (offset, length) spans to be copied from the file.
+    """
+    segments = []
+    for start, end in ranges:
+        segments.append((
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{file_size}\r\n'
+            '\r\n'
+        ).encode('ascii'))
+        segments.append((start, end - start + 1))
+        segments.append(b'\r\n')
+    segments.append(f'--{boundary}--\r\n'.encode('ascii'))
+    return segments
+
+
+def segments_length(segments):
+    """Total number of bytes a multipart_segments() body will produce"""
+    return sum(
+        len(segment) if isinstance(segment, bytes) else segment[1]
+        for segment in segments
+    )
+
+
+DELIVERY_BACKENDS = ('python', 'x-accel-redirect', 'x-sendfile')
+
+
+def offload_response(file_path, content_type, backend):
+    """Empty response asking the front-end server to send `file_path` itself.
+
+    `x-accel-redirect` points nginx at an internal location mapped onto
+    MEDIA_ROOT; `x-sendfile` gives Apache/lighttpd the absolute path. The
+    front-end server then handles Range and conditional requests.
+    """
+    response = HttpResponse(content_type=content_type)
+    if backend == 'x-accel-redirect':
+        relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        prefix = settings.VIDEO_ACCEL_REDIRECT_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f'{prefix}/{quote(relative_path)}'
+    elif backend == 'x-sendfile':
+        response['X-Sendfile'] = file_path
+    else:
+        raise ImproperlyConfigured(
+            f"VIDEO_DELIVERY_BACKEND must be one of {', '.join(DELIVERY_BACKENDS)}, not {backend!r}"
+        )
+    return response
@@ -0,0 +1,35 @@
+"""
+Tasks run by the background job worker
+"""
+
+from . import gc, jobs, processing, related, uploads
+
+
+@jobs.task('process_video', priority=10, max_attempts=3, timeout=15 * 60, on_failure=processing.processing_failed)
+def process_video(video_id):
+    processing.process_video(video_id)
+
+
+@jobs.task('compute_related', timeout=60 * 60)
+def compute_related():
+    related.compute_related()
+
+
+@jobs.task('clear_stale_uploads')
+def clear_stale_uploads():
+    uploads.remove_expired()
+
+
+@jobs.task('delete_media', priority=-5)
+def delete_media(names):
+    gc.delete_media(names)
+
+
+@jobs.task('gc_media', priority=-10, timeout=60 * 60)
+def gc_media():
+    gc.collect()
+
+
+@jobs.task('prune_jobs', priority=-10)
+def prune_jobs():
+    jobs.prune()
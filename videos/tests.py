@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+
+from django.http import FileResponse
+from django.test import SimpleTestCase, override_settings
+
+from . import metrics
+
+
+def _histogram(name):
+    state = metrics.registry.snapshot()['histograms']
+    for metric, labels, values in state:
+        if metric == name and not labels:
+            return values['sum'], values['count']
+    return 0.0, 0
+
+
+@override_settings(VIDEO_METRICS_DIR='')
+class InstrumentStreamTests(SimpleTestCase):
+    def test_sendfile_response_records_bounded_ttfb_and_throughput(self):
+        size = 1024 * 1024
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(size))
+        self.addCleanup(os.remove, f.name)
+        ttfb_before = _histogram('videostream_stream_ttfb_seconds')
+        throughput_before = _histogram('videostream_stream_throughput_bytes_per_second')
+
+        started = time.perf_counter()
+        response = FileResponse(open(f.name, 'rb'))
+        response['Content-Length'] = str(size)
+        response = metrics.instrument_stream(response, 1, started)
+        handed_off = time.perf_counter() - started
+        # The server sending the file
+        time.sleep(0.05)
+        b''.join(response.streaming_content)
+        response.close()
+        total = time.perf_counter() - started
+
+        ttfb_sum, ttfb_count = _histogram('videostream_stream_ttfb_seconds')
+        self.assertEqual(ttfb_count - ttfb_before[1], 1)
+        self.assertLessEqual(ttfb_sum - ttfb_before[0], handed_off)
+        throughput_sum, throughput_count = _histogram('videostream_stream_throughput_bytes_per_second')
+        self.assertEqual(throughput_count - throughput_before[1], 1)
+        throughput = throughput_sum - throughput_before[0]
+        self.assertGreaterEqual(throughput, size / total)
+        self.assertLessEqual(throughput, size / 0.05)
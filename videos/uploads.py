@@ -0,0 +1,222 @@
+"""
+Resumable chunked uploads written straight to disk
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import UploadChunk, UploadSession, Video
+from .processing import queue_processing
+from .storage import media_storage
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    """A chunk or checksum header the server can't accept"""
+
+
+class ChecksumMismatch(UploadError):
+    """A chunk whose bytes don't match its Upload-Checksum"""
+
+
+class ChunkReceived(UploadError):
+    """A chunk that was already recorded, so is never written again"""
+
+
+def parse_checksum(header):
+    """Decode a tus-style 'sha256 <base64 digest>' header; None when absent"""
+    if not header:
+        return None
+    algorithm, _, value = header.partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError(f'Unsupported checksum algorithm {algorithm!r}; use sha256')
+    try:
+        digest = base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError('Upload-Checksum is not valid base64')
+    if len(digest) != hashlib.sha256().digest_size:
+        raise UploadError('Upload-Checksum is not a sha256 digest')
+    return digest
+
+
+def create_part_file(session):
+    """Create the sparse file the chunks are written into, at its final size"""
+    os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+    descriptor = os.open(session.part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        os.ftruncate(descriptor, session.size)
+    finally:
+        os.close(descriptor)
+
+
+def write_chunk(session, index, stream, checksum=None):
+    """Copy chunk `index` from `stream` to its offset in the part file.
+
+    The body is spooled to a temporary file in small blocks and only copied
+    into the part file once its length and checksum are right, so a chunk
+    never sits in memory, chunks of one session can arrive in parallel and
+    a bad retry can't clobber bytes already received. The chunk's row is
+    claimed first, so of several requests for one chunk only one writes it;
+    the others raise ChunkReceived without reading the body. A write that
+    fails gives the claim up again.
+    """
+    chunk = _claim_chunk(session, index)
+    try:
+        sha256 = _write_claimed(session, index, stream, checksum)
+    except BaseException:
+        UploadChunk.objects.filter(pk=chunk.pk, sha256='').delete()
+        raise
+    UploadChunk.objects.filter(pk=chunk.pk).update(sha256=sha256)
+    # Keeps an upload that is still making progress from expiring
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+
+def _claim_chunk(session, index):
+    """Insert the row for chunk `index`, or raise ChunkReceived if another request has it"""
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return UploadChunk.objects.create(session=session, index=index)
+        except IntegrityError:
+            # A claim whose request died mid-write is given up after a while
+            cutoff = timezone.now() - timedelta(seconds=settings.VIDEO_UPLOAD_CHUNK_CLAIM_SECONDS)
+            deleted, _ = UploadChunk.objects.filter(
+                session=session, index=index, sha256='', claimed_at__lt=cutoff
+            ).delete()
+            if not deleted:
+                break
+    raise ChunkReceived(f'Chunk {index} was already received')
+
+
+def _write_claimed(session, index, stream, checksum):
+    """Verify the chunk in a spool file, copy it into the part file and return its sha256"""
+    length = session.chunk_length(index)
+    digest = hashlib.sha256()
+    received = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(session.part_path)) as spool:
+        while received < length:
+            block = stream.read(min(READ_SIZE, length - received))
+            if not block:
+                break
+            spool.write(block)
+            digest.update(block)
+            received += len(block)
+        trailing = stream.read(1)
+
+        if received != length or trailing:
+            raise UploadError(f'Chunk {index} must be exactly {length} bytes')
+        if checksum is not None and digest.digest() != checksum:
+            raise ChecksumMismatch(f'Chunk {index} does not match its checksum')
+        spool.flush()
+        _copy_into(spool.fileno(), session.part_path, index * session.chunk_size, length)
+    return digest.hexdigest()
+
+
+def _copy_into(source, path, offset, length):
+    """Copy `length` bytes from the start of descriptor `source` to `offset` in `path`"""
+    descriptor = os.open(path, os.O_WRONLY)
+    try:
+        copied = 0
+        while copied < length:
+            try:
+                # Copied by the kernel, without passing through this process
+                written = os.copy_file_range(source, descriptor, length - copied, copied, offset + copied)
+            except (AttributeError, OSError):
+                written = os.pwrite(descriptor, os.pread(source, min(READ_SIZE, length - copied), copied),
+                                    offset + copied)
+            if not written:
+                raise UploadError('The chunk could not be written')
+            copied += written
+    finally:
+        os.close(descriptor)
+
+
+def received_chunks(session):
+    """Indexes of the chunks written completely"""
+    return set(session.chunks.exclude(sha256='').values_list('index', flat=True))
+
+
+def upload_offset(session, received):
+    """Bytes received without a gap from the start of the file"""
+    index = 0
+    while index in received:
+        index += 1
+    return min(index * session.chunk_size, session.size)
+
+
+def complete(session, received):
+    """Turn a session whose chunks have all arrived into a Video.
+
+    `received` is the set of chunk indexes recorded. Returns the Video, or
+    None while chunks are missing. With chunks sent in parallel several
+    requests can see the last one land; only the one that moves the session
+    to COMPLETING creates the Video.
+    """
+    if len(received) < session.chunk_count:
+        return None
+    claimed = UploadSession.objects.filter(pk=session.pk, status=UploadSession.UPLOADING).update(
+        status=UploadSession.COMPLETING, updated_at=timezone.now()
+    )
+    if not claimed:
+        session.refresh_from_db()
+        return session.video
+
+    name = None
+    try:
+        with transaction.atomic():
+            # Linked, not hashed: processing moves it to a content-addressed
+            # blob. The part file survives a failure here.
+            name = media_storage.ingest(session.part_path, session.filename)
+            video = Video.objects.create(
+                title=session.title,
+                description=session.description,
+                video_file=name,
+                file_size=session.size,
+                thumbnail=session.thumbnail.name or None,
+                uploader=session.user,
+                is_public=session.is_public,
+                processing_status=Video.QUEUED,
+                processing_progress=0,
+            )
+            session.status = UploadSession.COMPLETE
+            session.video = video
+            session.save(update_fields=['status', 'video', 'updated_at'])
+    except Exception:
+        if name:
+            media_storage.delete(name)
+        # Let resending a chunk try again instead of leaving the session stuck
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.UPLOADING)
+        session.status = UploadSession.UPLOADING
+        raise
+    os.remove(session.part_path)
+    session.chunks.all().delete()
+    queue_processing(video)
+    return video
+
+
+def abort(session):
+    """Delete an unfinished session and what it has received"""
+    try:
+        os.remove(session.part_path)
+    except FileNotFoundError:
+        pass
+    # Its thumbnail reference is released by the delete signal
+    session.delete()
+
+
+def remove_expired():
+    """Abort sessions idle for VIDEO_UPLOAD_EXPIRY_HOURS; returns how many"""
+    cutoff = timezone.now() - timedelta(hours=settings.VIDEO_UPLOAD_EXPIRY_HOURS)
+    sessions = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in sessions:
+        abort(session)
+    return len(sessions)
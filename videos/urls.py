@@ -1,19 +1,31 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+stream_view = views.AsyncVideoStreamView.get if settings.VIDEO_STREAM_ASYNC else views.VideoStreamView.get
+
 urlpatterns = [
     path('', views.home, name='home'),
     path('video/<int:video_id>/', views.video_detail, name='video_detail'),
     path('upload/', views.upload_video, name='upload_video'),
+    path('upload/sessions/', views.upload_create, name='upload_create'),
+    path('upload/sessions/<uuid:session_id>/', views.upload_session, name='upload_session'),
     path('my-videos/', views.my_videos, name='my_videos'),
     path('video/<int:video_id>/delete/', views.delete_video, name='delete_video'),
-    path('stream/<int:video_id>/', views.VideoStreamView.get, name='stream_video'),
+    path('video/<int:video_id>/comments/', views.video_comments, name='video_comments'),
+    path('stream/<int:video_id>/', stream_view, name='stream_video'),
+    path('stream/<int:video_id>/seek/', views.stream_seek, name='stream_seek'),
+    path('hls/<int:video_id>/master.m3u8', views.hls_master_playlist, name='hls_master_playlist'),
+    path('hls/<int:video_id>/<str:rendition>/<str:filename>', views.hls_rendition_file, name='hls_rendition_file'),
+    path('artwork/<int:video_id>/<str:filename>', views.artwork_file, name='artwork_file'),
     path('register/', views.register, name='register'),
+    path('metrics/', views.metrics_endpoint, name='metrics'),
     
     # Monetization URLs (temporarily disabled)
     # path('monetization/', views.monetization_dashboard, name='monetization_dashboard'),
     # path('ad-settings/', views.ad_settings, name='ad_settings'),
     # path('track-ad/<int:ad_id>/', views.track_ad_view, name='track_ad_view'),
+    # path('track-ad/batch/', views.track_ad_events, name='track_ad_events'),
     # path('video/<int:video_id>/tip/', views.send_tip, name='send_tip'),
     # path('subscription-plans/', views.subscription_plans, name='subscription_plans'),
     # path('subscribe/<int:plan_id>/', views.subscribe, name='subscribe'),
@@ -0,0 +1,167 @@
+"""
+Write-behind buffer for video view counts
+"""
+
+import atexit
+import hashlib
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Q
+
+from .clients import client_ip
+from .models import Video, VideoCoView
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Per-process buffer of view increments flushed in bulk.
+
+    Page views only bump an in-memory counter; a daemon thread writes the
+    totals every VIDEO_VIEW_FLUSH_INTERVAL seconds as one atomic
+    `views = views + n` UPDATE per distinct n, so concurrent workers never
+    lose increments and hot videos don't queue on the database write lock.
+    With VIDEO_VIEW_FLUSH_INTERVAL = 0 every view is written immediately.
+
+    Pairs of videos watched by the same viewer within
+    VIDEO_COVIEW_SESSION_SECONDS are buffered the same way into
+    VideoCoView for the related-videos job.
+    """
+
+    def __init__(self):
+        self._pending = Counter()
+        self._pairs = Counter()
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    def record(self, video_id, request=None):
+        """Count a view unless the same viewer saw the video recently. Returns True if counted."""
+        viewer = self._viewer(request) if request is not None else None
+        if viewer is not None and not self._first_view(video_id, viewer):
+            return False
+        pairs = self._session_pairs(video_id, viewer) if viewer is not None else []
+        if not settings.VIDEO_VIEW_FLUSH_INTERVAL:
+            Video.objects.filter(id=video_id).update(views=F('views') + 1)
+            if pairs:
+                self._write_coviews(Counter(pairs))
+            return True
+        with self._lock:
+            self._pending[video_id] += 1
+            self._pairs.update(pairs)
+        self._ensure_flusher()
+        return True
+
+    def pending(self, video_id):
+        """Views of a video recorded in this process but not written yet"""
+        with self._lock:
+            return self._pending.get(video_id, 0)
+
+    @staticmethod
+    def _viewer(request):
+        """Stable hash identifying who made a request"""
+        if request.user.is_authenticated:
+            viewer = f'user:{request.user.pk}'
+        elif getattr(request, 'session', None) is not None and request.session.session_key:
+            viewer = f'session:{request.session.session_key}'
+        else:
+            viewer = f"ip:{client_ip(request)}:{request.META.get('HTTP_USER_AGENT', '')}"
+        return hashlib.sha1(viewer.encode()).hexdigest()
+
+    @staticmethod
+    def _first_view(video_id, viewer):
+        window = settings.VIDEO_VIEW_DEDUPE_SECONDS
+        if not window:
+            return True
+        return caches[settings.VIDEO_VIEW_DEDUPE_CACHE].add(f'video-view:{video_id}:{viewer}', 1, window)
+
+    @staticmethod
+    def _session_pairs(video_id, viewer):
+        """Pairs of this video with the ones the viewer watched earlier in the session"""
+        if not settings.VIDEO_COVIEW_HISTORY:
+            return []
+        cache = caches[settings.VIDEO_VIEW_DEDUPE_CACHE]
+        key = f'video-history:{viewer}'
+        history = [other for other in cache.get(key, []) if other != video_id]
+        cache.set(key, (history + [video_id])[-settings.VIDEO_COVIEW_HISTORY:], settings.VIDEO_COVIEW_SESSION_SECONDS)
+        return [(min(video_id, other), max(video_id, other)) for other in history]
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name='view-counter', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(settings.VIDEO_VIEW_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing view counts failed')
+            finally:
+                connection.close()
+
+    def flush(self):
+        """Write buffered views and co-views to the database. Returns the number of views written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            pairs, self._pairs = self._pairs, Counter()
+        written = Counter()
+        try:
+            for amount, video_ids in _group_by_amount(pending).items():
+                Video.objects.filter(id__in=video_ids).update(views=F('views') + amount)
+                written.update(dict.fromkeys(video_ids, amount))
+            if pairs:
+                self._write_coviews(pairs)
+                pairs = Counter()
+        except Exception:
+            # Keep what wasn't written for the next flush
+            with self._lock:
+                self._pending.update(pending - written)
+                self._pairs.update(pairs)
+            raise
+        return sum(written.values())
+
+    @staticmethod
+    def _write_coviews(pairs):
+        """Add buffered pair counts to VideoCoView, creating missing rows"""
+        video_ids = {video_id for pair in pairs for video_id in pair}
+        existing = set(Video.objects.filter(id__in=video_ids).values_list('id', flat=True))
+        pairs = {pair: amount for pair, amount in pairs.items() if pair[0] in existing and pair[1] in existing}
+        VideoCoView.objects.bulk_create(
+            [VideoCoView(video_id=first, other_id=second) for first, second in pairs],
+            ignore_conflicts=True,
+        )
+        for amount, keys in _group_by_amount(pairs).items():
+            for start in range(0, len(keys), 100):
+                condition = Q()
+                for first, second in keys[start:start + 100]:
+                    condition |= Q(video_id=first, other_id=second)
+                VideoCoView.objects.filter(condition).update(count=F('count') + amount)
+
+    def stop(self):
+        """Stop the flusher thread and write what is left"""
+        self._stopped.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing view counts at exit failed')
+
+
+def _group_by_amount(counts):
+    """{key: n} -> {n: [keys]}, so each distinct increment is one UPDATE"""
+    grouped = {}
+    for key, amount in counts.items():
+        grouped.setdefault(amount, []).append(key)
+    return grouped
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter.stop)
@@ -1,53 +1,103 @@
 import os
-import mimetypes
+import re
+import functools
+import itertools
+import secrets
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q
-from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
 from django.views.decorators.http import require_http_methods
-from .models import Video, Comment
-from .forms import VideoUploadForm, CommentForm, UserRegistrationForm
+from .models import Video, Comment, UploadSession
+from .forms import VideoUploadForm, CommentForm, UserRegistrationForm, UploadSessionForm
+from . import metrics, page_cache, pacing, search, uploads
+from .pagination import KeysetPage, approximate_count
+from .processing import queue_processing
+from .block_cache import block_cache
+from .clients import client_ip
+from .stream_cache import stream_meta_cache, get_stream_meta, aget_stream_meta
+from .view_counter import view_counter
+from .streaming import (
+    RangeFileWrapper, RangeNotSatisfiable, parse_range_header, file_etag,
+    if_range_matches, multipart_segments, segments_length, offload_response,
+)
+
+HLS_NAME_RE = re.compile(r'^[\w-]+$')
+HLS_FILE_RE = re.compile(r'^[\w-]+\.(m3u8|ts)$')
+ARTWORK_FILE_RE = re.compile(r'^[\w-]+\.(jpg|webp|vtt)$')
+ARTWORK_CONTENT_TYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'vtt': 'text/vtt'}
+
 # Temporarily disabled monetization imports
 # from .monetization_views import monetization_dashboard, ad_settings, track_ad_view, send_tip, subscription_plans, subscribe, earnings_report
 
 
+@metrics.instrument_page
+@page_cache.cache_anonymous_page(lambda: ('videos',))
 def home(request):
     """Home page with latest videos"""
     videos = Video.objects.filter(is_public=True).select_related('uploader')
     
-    # Search functionality
-    search_query = request.GET.get('search', '')
+    # Search functionality: ranked full-text index, LIKE when there is none
+    search_query = request.GET.get('search', '').strip()
+    video_ids = None
     if search_query:
-        videos = videos.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(uploader__username__icontains=search_query)
-        )
+        video_ids = search.search_video_ids(search_query)
+        if video_ids is None:
+            videos = search.fallback_filter(videos, search_query)
     
-    # Pagination
-    paginator = Paginator(videos, 12)
-    page_number = request.GET.get('page')
-    videos = paginator.get_page(page_number)
+    # Pagination: ranked search results by page number, the feed by cursor
+    if video_ids is not None:
+        # Paginate the ranked ids, then load only the page's videos in rank order
+        videos_page = Paginator(video_ids, 12).get_page(request.GET.get('page'))
+        found = videos.in_bulk(videos_page.object_list)
+        videos_page.object_list = [found[video_id] for video_id in videos_page.object_list if video_id in found]
+        search.highlight_videos(search_query, videos_page.object_list)
+        videos = videos_page
+    else:
+        videos = KeysetPage(videos, request.GET.get('cursor'), per_page=12)
     
     context = {
         'videos': videos,
         'search_query': search_query,
+        'videos_version': page_cache.versions('videos'),
+        'fragment_ttl': settings.VIDEO_FRAGMENT_CACHE_TTL,
     }
     return render(request, 'videos/home.html', context)
 
 
+def _count_cached_view(request, video_id):
+    """A detail page served from the page cache still counts as a view"""
+    view_counter.record(video_id, request)
+
+
+@metrics.instrument_page
+@page_cache.cache_anonymous_page(
+    lambda video_id: ('videos', 'related', f'video:{video_id}'),
+    on_hit=_count_cached_view,
+)
 def video_detail(request, video_id):
     """Video detail page with player and comments"""
-    video = get_object_or_404(Video, id=video_id, is_public=True)
+    video = get_object_or_404(
+        Video.objects.select_related('uploader').prefetch_related('renditions'), id=video_id, is_public=True
+    )
     
-    # Increment views
-    video.increment_views()
+    # Increment views (buffered, repeat views from the same viewer are ignored)
+    if request.method == 'GET':
+        video.increment_views(request)
     
-    # Get comments
-    comments = video.comments.select_related('user').order_by('-created_at')
+    # First page of comments; the rest load from video_comments
+    comments = KeysetPage(
+        video.comments.select_related('user'), per_page=settings.VIDEO_COMMENTS_PAGE_SIZE, field='created_at'
+    )
     
     # Handle comment form
     comment_form = CommentForm()
@@ -61,93 +111,159 @@ def video_detail(request, video_id):
             messages.success(request, 'Your comment has been added!')
             return redirect('video_detail', video_id=video_id)
     
-    # Related videos
-    related_videos = Video.objects.filter(
-        is_public=True
-    ).exclude(id=video.id)[:6]
-    
     context = {
         'video': video,
         'comments': comments,
         'comment_form': comment_form,
-        'related_videos': related_videos,
+        # Loaded only if the sidebar fragment isn't cached
+        'related_videos': SimpleLazyObject(lambda: _related_videos(video)),
+        'video_version': page_cache.versions(f'video:{video.id}'),
+        'related_version': page_cache.versions('videos', 'related'),
+        'fragment_ttl': settings.VIDEO_FRAGMENT_CACHE_TTL,
     }
     return render(request, 'videos/video_detail.html', context)
 
 
+def _related_videos(video):
+    """Related videos precomputed by compute_related_videos"""
+    related_videos = [
+        entry.related
+        for entry in video.related_entries.filter(related__is_public=True)
+        .select_related('related__uploader')[:settings.VIDEO_RELATED_COUNT]
+    ]
+    if not related_videos:
+        # Not computed for this video yet
+        related_videos = list(Video.objects.filter(
+            is_public=True
+        ).select_related('uploader').exclude(id=video.id)[:settings.VIDEO_RELATED_COUNT])
+    return related_videos
+
+
+
 class VideoStreamView:
-    """Efficient video streaming with range request support"""
+    """Efficient video streaming with range and conditional request support"""
     
-    @staticmethod
-    def get(request, video_id):
-        video = get_object_or_404(Video, id=video_id, is_public=True)
+    @classmethod
+    def get(cls, request, video_id):
+        started = time.perf_counter()
+        meta = get_stream_meta(video_id)
+        if not meta.is_public:
+            raise Http404("No Video matches the given query.")
         
-        # Get video file path
-        video_path = video.video_file.path
-        if not os.path.exists(video_path):
+        try:
+            return metrics.instrument_stream(cls._respond(request, meta), video_id, started)
+        except FileNotFoundError:
+            # The cached entry outlived the file
+            stream_meta_cache.invalidate(video_id)
             raise Http404("Video file not found")
+    
+    @classmethod
+    def _respond(cls, request, meta):
+        """Build the response for a video described by a StreamMeta"""
+        video_path, file_size, content_type = meta.path, meta.size, meta.content_type
         
-        # Get file info
-        file_size = os.path.getsize(video_path)
-        content_type = mimetypes.guess_type(video_path)[0] or 'video/mp4'
+        # Let nginx/Apache send the bytes once the video is known to be public
+        backend = settings.VIDEO_DELIVERY_BACKEND
+        if backend != 'python':
+            return offload_response(video_path, content_type, backend)
         
-        # Handle range requests for efficient streaming
-        range_header = request.META.get('HTTP_RANGE')
-        if range_header:
-            return VideoStreamView._handle_range_request(video_path, file_size, content_type, range_header)
+        etag = file_etag(file_size, meta.mtime)
+        last_modified = int(meta.mtime)
         
-        # Regular response for non-range requests
-        response = StreamingHttpResponse(
-            VideoStreamView._file_iterator(video_path),
-            content_type=content_type
-        )
-        response['Content-Length'] = str(file_size)
+        # Answer If-None-Match / If-Modified-Since revalidation with a 304
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = cls._handle_range_request(request, meta, etag, last_modified)
+        
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
         response['Accept-Ranges'] = 'bytes'
         return response
     
-    @staticmethod
-    def _handle_range_request(file_path, file_size, content_type, range_header):
-        """Handle HTTP range requests for video streaming"""
-        try:
-            byte_start = 0
-            byte_end = file_size - 1
-            
-            # Parse range header
-            if range_header.startswith('bytes='):
-                ranges = range_header[6:].split(',')[0]
-                if '-' in ranges:
-                    start, end = ranges.split('-', 1)
-                    if start:
-                        byte_start = int(start)
-                    if end:
-                        byte_end = int(end)
-            
-            # Ensure valid range
-            byte_start = max(0, byte_start)
-            byte_end = min(file_size - 1, byte_end)
-            content_length = byte_end - byte_start + 1
-            
-            # Create streaming response
-            response = StreamingHttpResponse(
-                VideoStreamView._file_iterator(file_path, byte_start, content_length),
-                status=206,  # Partial Content
-                content_type=content_type
+    @classmethod
+    def _handle_range_request(cls, request, meta, etag, last_modified):
+        """Handle HTTP range requests for video streaming (RFC 7233)"""
+        file_size, content_type = meta.size, meta.content_type
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE')
+        
+        # A stale If-Range validator means the client gets the whole file
+        if range_header and if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, last_modified):
+            try:
+                ranges = parse_range_header(range_header, file_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{file_size}'
+                return response
+        
+        # Regular response for missing or malformed range headers
+        if not ranges:
+            return cls._file_response(request, meta, 0, file_size)
+        
+        if len(ranges) == 1:
+            byte_start, byte_end = ranges[0]
+            response = cls._file_response(
+                request, meta, byte_start, byte_end - byte_start + 1,
+                status=206  # Partial Content
             )
-            
-            response['Content-Length'] = str(content_length)
             response['Content-Range'] = f'bytes {byte_start}-{byte_end}/{file_size}'
-            response['Accept-Ranges'] = 'bytes'
-            
             return response
-            
-        except (ValueError, OSError):
-            # If range parsing fails, return full file
-            response = StreamingHttpResponse(
-                VideoStreamView._file_iterator(file_path),
+        
+        # Several ranges go out as one multipart/byteranges body
+        boundary = secrets.token_hex(16)
+        segments = multipart_segments(ranges, content_type, file_size, boundary)
+        body = cls._segments_iterator(request, meta.path, segments, settings.VIDEO_STREAM_CHUNK_SIZE)
+        if pacing.is_active():
+            body = cls._paced(body, meta.bitrate, pacing.burst_key(request, meta.path))
+        response = StreamingHttpResponse(
+            body,
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(segments_length(segments))
+        return response
+    
+    @classmethod
+    def _file_response(cls, request, meta, offset, length, status=200):
+        """Build a response for `length` bytes of the file starting at `offset`.
+
+        Hot ranges of popular videos are served from the block cache; when
+        the body goes through Python anyway, longer ranges such as an
+        open-ended `bytes=0-` take their leading blocks from it too.
+        Otherwise, with VIDEO_STREAM_SENDFILE enabled the open file is handed
+        to the server's wsgi.file_wrapper so the bytes can go out through
+        os.sendfile, or else they are pushed through `_file_iterator`.
+        Paced streams always go through Python, since sendfile can't be
+        throttled.
+        """
+        file_path, content_type = meta.path, meta.content_type
+        chunk_size = settings.VIDEO_STREAM_CHUNK_SIZE
+        sendfile = settings.VIDEO_STREAM_SENDFILE and not pacing.is_active()
+        # sendfile can't follow bytes from memory, so only whole ranges come from the cache then
+        chunks = block_cache.get_range(meta, offset, length, partial=not sendfile)
+        if chunks is not None:
+            served = sum(len(chunk) for chunk in chunks)
+            body = iter(chunks)
+            if served < length:
+                body = itertools.chain(body, cls._file_iterator(file_path, offset + served, length - served, chunk_size))
+        elif sendfile:
+            response = FileResponse(
+                RangeFileWrapper(open(file_path, 'rb'), offset, length),
+                status=status,
                 content_type=content_type
             )
-            response['Content-Length'] = str(file_size)
+            # Also used as the wsgi.file_wrapper block size when iterating
+            response.block_size = chunk_size
+            response['Content-Length'] = str(length)
             return response
+        else:
+            body = cls._file_iterator(file_path, offset, length, chunk_size)
+        
+        if pacing.is_active():
+            body = cls._paced(body, meta.bitrate, pacing.burst_key(request, meta.path))
+        response = StreamingHttpResponse(body, status=status, content_type=content_type)
+        response['Content-Length'] = str(length)
+        return response
     
     @staticmethod
     def _file_iterator(file_path, offset=0, length=None, chunk_size=8192):
@@ -170,8 +286,238 @@ class VideoStreamView:
                     remaining -= len(data)
                 
                 yield data
+    
+    @staticmethod
+    def _paced(body, bitrate, burst_key=None):
+        return pacing.paced(body, bitrate, burst_key)
+    
+    @classmethod
+    def _segments_iterator(cls, request, file_path, segments, chunk_size=8192):
+        """Iterator for a multipart/byteranges body laid out by multipart_segments"""
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                offset, length = segment
+                yield from cls._file_iterator(file_path, offset, length, chunk_size)
+
 
+class AsyncVideoStreamView(VideoStreamView):
+    """Native async variant of VideoStreamView for the ASGI deployment.
 
+    The video lookup goes through the async ORM and file chunks come from an
+    async iterator whose reads run in the default thread pool, so a playback
+    connection holds no thread while it waits on the client. Streams stop
+    reading as soon as videostream.asgi reports that the client went away.
+    """
+    
+    @classmethod
+    async def get(cls, request, video_id):
+        started = time.perf_counter()
+        meta = await aget_stream_meta(video_id)
+        if not meta.is_public:
+            raise Http404("No Video matches the given query.")
+        
+        return metrics.instrument_stream(cls._respond(request, meta), video_id, started)
+    
+    @classmethod
+    def _file_response(cls, request, meta, offset, length, status=200):
+        """Build an async streaming response for `length` bytes from `offset`"""
+        body = cls._range_iterator(
+            meta, offset, length, settings.VIDEO_STREAM_CHUNK_SIZE,
+            disconnected=cls._disconnected_event(request)
+        )
+        if pacing.is_active():
+            body = cls._paced(body, meta.bitrate, pacing.burst_key(request, meta.path))
+        response = StreamingHttpResponse(body, status=status, content_type=meta.content_type)
+        response['Content-Length'] = str(length)
+        return response
+    
+    @staticmethod
+    def _paced(body, bitrate, burst_key=None):
+        return pacing.apaced(body, bitrate, burst_key)
+    
+    @staticmethod
+    def _disconnected_event(request):
+        """asyncio.Event set by videostream.asgi when the client disconnects"""
+        return getattr(request, 'scope', {}).get('client_disconnected')
+    
+    @classmethod
+    async def _range_iterator(cls, meta, offset, length, chunk_size, disconnected=None):
+        """Async iterator serving a range from the block cache or the file"""
+        chunks = []
+        if block_cache.enabled:
+            chunks = await sync_to_async(block_cache.get_range, thread_sensitive=False)(
+                meta, offset, length, partial=True
+            ) or []
+        served = 0
+        for chunk in chunks:
+            if disconnected and disconnected.is_set():
+                return
+            yield chunk
+            served += len(chunk)
+        if served < length:
+            async for data in cls._file_iterator(meta.path, offset + served, length - served, chunk_size, disconnected):
+                yield data
+    
+    @staticmethod
+    async def _file_iterator(file_path, offset=0, length=None, chunk_size=8192, disconnected=None):
+        """Async iterator for streaming file content with offloaded reads"""
+        run = functools.partial(sync_to_async, thread_sensitive=False)
+        f = await run(open)(file_path, 'rb')
+        try:
+            await run(f.seek)(offset)
+            remaining = length
+            while not (disconnected and disconnected.is_set()):
+                bytes_to_read = chunk_size
+                if remaining is not None:
+                    bytes_to_read = min(bytes_to_read, remaining)
+                    if bytes_to_read <= 0:
+                        break
+                
+                data = await run(f.read)(bytes_to_read)
+                if not data:
+                    break
+                
+                if remaining is not None:
+                    remaining -= len(data)
+                
+                yield data
+        finally:
+            f.close()
+    
+    @classmethod
+    async def _segments_iterator(cls, request, file_path, segments, chunk_size=8192):
+        """Async iterator for a multipart/byteranges body"""
+        disconnected = cls._disconnected_event(request)
+        for segment in segments:
+            if disconnected and disconnected.is_set():
+                break
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                offset, length = segment
+                async for data in cls._file_iterator(file_path, offset, length, chunk_size, disconnected):
+                    yield data
+
+
+@require_http_methods(["GET"])
+def video_comments(request, video_id):
+    """JSON page of a video's comments, newest first, for the "load more" button"""
+    if not Video.objects.filter(id=video_id, is_public=True).exists():
+        raise Http404("No Video matches the given query.")
+    comments = KeysetPage(
+        Comment.objects.filter(video_id=video_id).select_related('user'),
+        request.GET.get('cursor'), per_page=settings.VIDEO_COMMENTS_PAGE_SIZE, field='created_at',
+    )
+    return JsonResponse({
+        'comments': [comment.as_json() for comment in comments],
+        'next_cursor': comments.next_cursor,
+    })
+
+
+@require_http_methods(["GET"])
+def stream_seek(request, video_id):
+    """Map a playback time onto the keyframe-aligned byte range to request"""
+    meta = get_stream_meta(video_id)
+    if not meta.is_public:
+        raise Http404("No Video matches the given query.")
+    
+    try:
+        seconds = max(0.0, float(request.GET.get('t', 0)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid time'}, status=400)
+    
+    video = get_object_or_404(Video.objects.only('id', 'keyframe_index'), id=video_id)
+    keyframe = video.keyframe_at(seconds)
+    if keyframe is None:
+        return JsonResponse({'error': 'No keyframe index for this video'}, status=404)
+    
+    time, offset = keyframe
+    return JsonResponse({
+        'time': time,
+        'offset': offset,
+        'range': f'bytes={offset}-{meta.size - 1}',
+    })
+
+
+def hls_master_playlist(request, video_id):
+    """HLS master playlist listing a video's packaged renditions"""
+    response = _serve_hls_file(video_id, 'master.m3u8')
+    # Rewritten as renditions finish packaging
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def hls_rendition_file(request, video_id, rendition, filename):
+    """HLS rendition playlist or media segment"""
+    if not HLS_NAME_RE.match(rendition) or not HLS_FILE_RE.match(filename):
+        raise Http404("Invalid HLS path")
+    response = _serve_hls_file(video_id, f'{rendition}/{filename}')
+    response['Cache-Control'] = f'public, max-age={settings.VIDEO_HLS_CACHE_SECONDS}'
+    return response
+
+
+def _serve_hls_file(video_id, relative_path):
+    """Serve a file from a public video's HLS directory"""
+    meta = get_stream_meta(video_id)
+    if not meta.is_public:
+        raise Http404("No Video matches the given query.")
+    
+    file_path = os.path.join(settings.MEDIA_ROOT, 'hls', str(video_id), relative_path)
+    content_type = 'application/vnd.apple.mpegurl' if file_path.endswith('.m3u8') else 'video/mp2t'
+    backend = settings.VIDEO_DELIVERY_BACKEND
+    if backend != 'python':
+        return offload_response(file_path, content_type, backend)
+    try:
+        return FileResponse(open(file_path, 'rb'), content_type=content_type)
+    except FileNotFoundError:
+        raise Http404("HLS file not found")
+
+
+@require_http_methods(["GET"])
+def artwork_file(request, video_id, filename):
+    """Generated poster, thumbnail or sprite file; names are content-hashed so never change"""
+    if not ARTWORK_FILE_RE.match(filename):
+        raise Http404("Invalid artwork path")
+    meta = get_stream_meta(video_id)
+    if not meta.is_public and not Video.objects.filter(id=video_id, uploader_id=request.user.id).exists():
+        raise Http404("No Video matches the given query.")
+
+    file_path = os.path.join(settings.MEDIA_ROOT, 'artwork', str(video_id), filename)
+    content_type = ARTWORK_CONTENT_TYPES[filename.rsplit('.', 1)[1]]
+    backend = settings.VIDEO_DELIVERY_BACKEND
+    if backend != 'python':
+        response = offload_response(file_path, content_type, backend)
+    else:
+        try:
+            response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            raise Http404("Artwork file not found")
+    visibility = 'public' if meta.is_public else 'private'
+    response['Cache-Control'] = f'{visibility}, max-age={settings.VIDEO_ARTWORK_CACHE_SECONDS}, immutable'
+    return response
+
+
+@require_http_methods(["GET"])
+def metrics_endpoint(request):
+    """Prometheus scrape endpoint for streaming and page metrics.
+
+    Served to client addresses in VIDEO_METRICS_ALLOWED_IPS, resolved
+    through trusted proxies, and with VIDEO_METRICS_TOKEN set only to
+    requests sending it as a bearer token.
+    """
+    allowed = settings.VIDEO_METRICS_ALLOWED_IPS
+    if allowed and client_ip(request) not in allowed:
+        raise Http404("Not found")
+    token = settings.VIDEO_METRICS_TOKEN
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if token and not (scheme.lower() == 'bearer' and secrets.compare_digest(credentials.strip(), token)):
+        raise Http404("Not found")
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics.instrument_page
 @login_required
 def upload_video(request):
     """Video upload page"""
@@ -180,16 +526,126 @@ def upload_video(request):
         if form.is_valid():
             video = form.save(commit=False)
             video.uploader = request.user
+            # Known from the upload; processing fills in the rest of the media information
+            video.file_size = form.cleaned_data['video_file'].size
+            video.processing_status = Video.QUEUED
+            video.processing_progress = 0
             video.save()
-            
+            queue_processing(video)
+
             messages.success(request, 'Video uploaded successfully!')
             return redirect('video_detail', video_id=video.id)
     else:
         form = VideoUploadForm()
     
-    return render(request, 'videos/upload_video.html', {'form': form})
+    return render(request, 'videos/upload_video.html', {
+        'form': form,
+        'max_upload_size': settings.VIDEO_MAX_UPLOAD_SIZE,
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def upload_create(request):
+    """Start a resumable upload from the video's details; the file follows in chunks"""
+    form = UploadSessionForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    session = form.save(commit=False)
+    session.user = request.user
+    session.chunk_size = settings.VIDEO_UPLOAD_CHUNK_SIZE
+    session.save()
+    uploads.create_part_file(session)
+
+    response = _upload_state_response(session, set(), status=201)
+    response['Location'] = response['Content-Location']
+    return response
+
+
+@login_required
+@require_http_methods(["HEAD", "GET", "PATCH", "DELETE"])
+def upload_session(request, session_id):
+    """tus-like upload resource.
 
+    HEAD reports Upload-Offset, the bytes received without a gap; GET also
+    lists the missing chunks for clients that upload in parallel. PATCH
+    writes the chunk starting at Upload-Offset, verifying Upload-Checksum
+    ("sha256 <base64>") when given; the request that delivers the last chunk
+    creates the Video and answers 201 with its URL; a chunk already received
+    is not written again and answers 409. DELETE abandons the upload.
+    """
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    if request.method == 'DELETE':
+        uploads.abort(session)
+        return HttpResponse(status=204)
+    if request.method == 'PATCH' and session.status == UploadSession.UPLOADING:
+        return _upload_chunk(request, session)
+    if request.method == 'PATCH' and session.status == UploadSession.COMPLETING:
+        return JsonResponse({'error': 'The upload is being completed'}, status=409)
 
+    response = _upload_state_response(session, uploads.received_chunks(session))
+    if request.method == 'HEAD':
+        response.content = b''
+    return response
+
+
+def _upload_chunk(request, session):
+    if request.content_type != 'application/offset+octet-stream':
+        return JsonResponse({'error': 'Chunks must be sent as application/offset+octet-stream'}, status=415)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Upload-Offset header required'}, status=400)
+    if offset < 0 or offset >= session.size or offset % session.chunk_size:
+        return JsonResponse({'error': f'Upload-Offset must be a multiple of {session.chunk_size} below {session.size}'},
+                            status=409)
+
+    conflict = None
+    try:
+        checksum = uploads.parse_checksum(request.headers.get('Upload-Checksum'))
+        uploads.write_chunk(session, offset // session.chunk_size, request, checksum)
+    except uploads.ChunkReceived as exc:
+        # Never rewritten, but resending one still finishes an interrupted completion
+        conflict = str(exc)
+    except uploads.ChecksumMismatch as exc:
+        # tus "Checksum Mismatch"
+        return JsonResponse({'error': str(exc)}, status=460)
+    except uploads.UploadError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    received = uploads.received_chunks(session)
+    video = uploads.complete(session, received)
+    if video is not None:
+        response = _upload_state_response(session, received, status=201)
+        response['Location'] = video.get_absolute_url()
+        return response
+    response = JsonResponse({'error': conflict}, status=409) if conflict else HttpResponse(status=204)
+    response['Upload-Offset'] = uploads.upload_offset(session, received)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _upload_state_response(session, received, status=200):
+    complete = session.status == UploadSession.COMPLETE
+    response = JsonResponse({
+        'url': reverse('upload_session', args=[session.id]),
+        'status': session.status,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'offset': session.size if complete else uploads.upload_offset(session, received),
+        'missing': [] if complete else [index for index in range(session.chunk_count) if index not in received],
+        'video_url': session.video.get_absolute_url() if complete and session.video else None,
+    }, status=status)
+    response['Content-Location'] = reverse('upload_session', args=[session.id])
+    response['Upload-Offset'] = session.size if complete else uploads.upload_offset(session, received)
+    response['Upload-Length'] = session.size
+    response['Upload-Chunk-Size'] = session.chunk_size
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@metrics.instrument_page
 def register(request):
     """User registration"""
     if request.method == 'POST':
@@ -205,16 +661,15 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
+@metrics.instrument_page
 @login_required
 def my_videos(request):
     """User's uploaded videos"""
-    videos = Video.objects.filter(uploader=request.user).order_by('-uploaded_at')
-    
-    paginator = Paginator(videos, 12)
-    page_number = request.GET.get('page')
-    videos = paginator.get_page(page_number)
+    videos = Video.objects.filter(uploader=request.user)
+    video_count = approximate_count(videos, f'uploader:{request.user.id}')
+    videos = KeysetPage(videos, request.GET.get('cursor'), per_page=12)
     
-    return render(request, 'videos/my_videos.html', {'videos': videos})
+    return render(request, 'videos/my_videos.html', {'videos': videos, 'video_count': video_count})
 
 
 @login_required
@@ -223,20 +678,13 @@ def delete_video(request, video_id):
     video = get_object_or_404(Video, id=video_id, uploader=request.user)
     
     if request.method == 'POST':
-        # Delete video file
-        if video.video_file:
-            try:
-                os.remove(video.video_file.path)
-            except OSError:
-                pass
-        
-        # Delete thumbnail file
-        if video.thumbnail:
-            try:
-                os.remove(video.thumbnail.path)
-            except OSError:
-                pass
+        # Stop serving cached pages that embed the stream before its file goes
+        page_cache.invalidate_video(video.id)
+        stream_meta_cache.invalidate(video.id)
         
+        # Files are removed later by a job: the video and thumbnail once no
+        # identical upload references them, the HLS and artwork directories
+        # unconditionally
         video.delete()
         messages.success(request, 'Video deleted successfully!')
         return redirect('my_videos')
@@ -2,10 +2,59 @@
 ASGI config for videostream project.
 """
 
+import asyncio
 import os
 
+import django
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'videostream.settings')
 
+
+class DisconnectMiddleware:
+    """Tell long-lived streaming views when the client has gone away.
+
+    Django 4.2's ASGI handler stops calling `receive` once the request body
+    has been read, so a streaming response keeps reading the file after the
+    viewer closes the tab. Once the response has started this watches
+    `receive` for `http.disconnect`, sets `scope['client_disconnected']`
+    (an asyncio.Event checked by AsyncVideoStreamView between chunks) and
+    drops any further messages.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        disconnected = asyncio.Event()
+        scope = dict(scope, client_disconnected=disconnected)
+        watcher = None
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        async def send_until_disconnected(message):
+            nonlocal watcher
+            if disconnected.is_set():
+                return
+            if message['type'] == 'http.response.start' and watcher is None:
+                watcher = asyncio.ensure_future(watch_disconnect())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_until_disconnected)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
 application = get_asgi_application()
+
+# Django 5.0+ listens for disconnects itself and cancels the response
+if django.VERSION < (5, 0):
+    application = DisconnectMiddleware(application)
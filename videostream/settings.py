@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'videos.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -118,8 +119,210 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
 # File Upload Settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
+# Form uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to a
+# temporary file rather than held in worker memory.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2_621_440  # 2.5MB
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2_621_440  # 2.5MB, request bodies other than files
+VIDEO_MAX_UPLOAD_SIZE = 10 * 1024 * 1024 * 1024  # 10GB
+# Resumable uploads write chunks straight into MEDIA_ROOT/VIDEO_UPLOAD_DIR,
+# which must be on the same filesystem as MEDIA_ROOT/videos. Sessions idle
+# for VIDEO_UPLOAD_EXPIRY_HOURS are removed by clear_stale_uploads.
+VIDEO_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+VIDEO_UPLOAD_DIR = 'uploads'
+VIDEO_UPLOAD_EXPIRY_HOURS = 24
+# A chunk whose request died mid-write can be sent again after this long
+VIDEO_UPLOAD_CHUNK_CLAIM_SECONDS = 10 * 60
+
+# Video Streaming Settings
+# Hand open files to the server's wsgi.file_wrapper so gunicorn can serve
+# video bytes with os.sendfile; set to False to stream through Python.
+VIDEO_STREAM_SENDFILE = True
+VIDEO_STREAM_CHUNK_SIZE = 64 * 1024  # Python fallback read size
+# Route stream/<id>/ to the native async view; enable when serving
+# videostream.asgi with an ASGI server such as uvicorn or daphne.
+VIDEO_STREAM_ASYNC = os.environ.get('VIDEO_STREAM_ASYNC', '') == '1'
+# Per-process cache of stream metadata (path, size, mtime, content type);
+# name a cache alias to share entries between workers as well.
+VIDEO_STREAM_META_CACHE_SIZE = 1024
+VIDEO_STREAM_META_CACHE_TTL = 60  # seconds
+VIDEO_STREAM_META_CACHE_ALIAS = None
+# Who sends the video bytes: 'python' (this process), 'x-accel-redirect'
+# (nginx internal location mapped onto MEDIA_ROOT) or 'x-sendfile'.
+VIDEO_DELIVERY_BACKEND = os.environ.get('VIDEO_DELIVERY_BACKEND', 'python')
+VIDEO_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# In-memory cache of hot byte ranges of popular videos, per process.
+# A file is admitted after VIDEO_BLOCK_CACHE_ADMIT_AFTER requests; ranges
+# needing more than VIDEO_BLOCK_CACHE_MAX_LOAD_BLOCKS uncached blocks go
+# to sendfile instead, or when sendfile isn't used take their leading blocks
+# from memory and the rest from the file. Set VIDEO_BLOCK_CACHE_SIZE to 0 to disable.
+VIDEO_BLOCK_CACHE_SIZE = 64 * 1024 * 1024
+VIDEO_BLOCK_CACHE_BLOCK_SIZE = 1024 * 1024
+VIDEO_BLOCK_CACHE_ADMIT_AFTER = 3
+VIDEO_BLOCK_CACHE_MAX_LOAD_BLOCKS = 4
+VIDEO_BLOCK_CACHE_TRACKED_FILES = 4096
+# Token-bucket pacing of stream responses. After an unpaced burst of
+# VIDEO_PACING_BURST_SECONDS of playback, each stream is held to the video's
+# bitrate times the multiplier. The burst is tracked per client and file in
+# VIDEO_PACING_BURST_CACHE and refills at playback speed. VIDEO_EGRESS_LIMIT caps the bytes/second a
+# process sends across all streams. Paced streams bypass sendfile.
+VIDEO_PACING_ENABLED = False
+VIDEO_PACING_BITRATE_MULTIPLIER = 1.5
+VIDEO_PACING_BURST_SECONDS = 10
+VIDEO_PACING_BURST_CACHE = 'shared'
+VIDEO_PACING_DEFAULT_BITRATE = 4_000_000  # bits/s when the video's is unknown
+VIDEO_EGRESS_LIMIT = None  # bytes/s per process
+
+# View counts are buffered per process and written every
+# VIDEO_VIEW_FLUSH_INTERVAL seconds (0 writes each view immediately). A viewer
+# is counted once per video per VIDEO_VIEW_DEDUPE_SECONDS (0 counts every hit).
+VIDEO_VIEW_FLUSH_INTERVAL = 10
+VIDEO_VIEW_DEDUPE_SECONDS = 30 * 60
+VIDEO_VIEW_DEDUPE_CACHE = 'shared'
+# Videos watched by one viewer within a session are recorded as co-views
+VIDEO_COVIEW_HISTORY = 5  # earlier videos paired with each view, 0 disables
+VIDEO_COVIEW_SESSION_SECONDS = 60 * 60
+
+# Behind a reverse proxy every request comes from the proxy's address. For
+# requests from VIDEO_TRUSTED_PROXIES the client address is read from this
+# request.META key instead (see videos.clients.client_ip); '' disables.
+VIDEO_CLIENT_IP_HEADER = os.environ.get('VIDEO_CLIENT_IP_HEADER', 'HTTP_X_FORWARDED_FOR')
+VIDEO_TRUSTED_PROXIES = ['127.0.0.1', '::1']
+
+# Home page search: most ranked matches fetched from the full-text index
+VIDEO_SEARCH_MAX_RESULTS = 1000
+# Seconds a feed's approximate video count is cached
+VIDEO_FEED_COUNT_TTL = 300
+# Comments rendered with a video page and returned per "load more" request
+VIDEO_COMMENTS_PAGE_SIZE = 20
+
+# Related videos precomputed by compute_related_videos: a weighted mix of
+# TF-IDF text similarity, co-views and a same-uploader bonus
+VIDEO_RELATED_COUNT = 6
+VIDEO_RELATED_MAX_FEATURES = 5000  # TF-IDF terms; memory is videos x terms x 4 bytes
+VIDEO_RELATED_WEIGHTS = {'text': 0.5, 'coview': 0.4, 'uploader': 0.1}
+VIDEO_RELATED_CANDIDATES = 500  # videos a new upload is scored against while processing
+
+# Metrics served in Prometheus format at /metrics/. With VIDEO_METRICS_DIR set,
+# each worker writes its numbers there so a scrape of any worker sees them all.
+VIDEO_METRICS_DIR = os.environ.get('VIDEO_METRICS_DIR', '')
+VIDEO_METRICS_FLUSH_INTERVAL = 5  # seconds
+# Snapshots of exited workers are deleted at scrape time, as are ones not
+# rewritten for this long (a worker elsewhere that stopped, or one left idle)
+VIDEO_METRICS_STALE_SECONDS = 15 * 60
+VIDEO_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # empty list allows any client
+# When set, scrapers must also send 'Authorization: Bearer <token>'
+VIDEO_METRICS_TOKEN = os.environ.get('VIDEO_METRICS_TOKEN', '')
+
+# Query budgets: requests running more queries than their view's budget (by
+# URL name), or one query shape VIDEO_QUERY_DUPLICATE_THRESHOLD times (N+1),
+# are logged, or raise QueryBudgetExceeded in strict mode (set it in tests).
+# Offenders, plus VIDEO_QUERY_SAMPLE_RATE of other requests, are appended as
+# JSON lines to VIDEO_QUERY_SAMPLE_FILE for the benchmark tooling.
+VIDEO_QUERY_BUDGETS = {
+    'home': 6,
+    'video_detail': 8,
+    'video_comments': 3,
+    'stream_video': 2,
+    'artwork_file': 4,  # a private video's owner is looked up
+    'my_videos': 5,
+    'upload_video': 12,  # stores the file and queues its processing job
+    'upload_create': 6,
+    'upload_session': 24,  # the last chunk creates the Video and its job
+    'track_ad_view': 10,
+    'track_ad_events': 10,  # whatever the batch size
+    'delete_video': 14,  # cascades to renditions, co-views and related lists
+}
+VIDEO_QUERY_DUPLICATE_THRESHOLD = 5
+VIDEO_QUERY_BUDGET_STRICT = os.environ.get('VIDEO_QUERY_BUDGET_STRICT', '') == '1'
+VIDEO_QUERY_SAMPLE_FILE = os.environ.get('VIDEO_QUERY_SAMPLE_FILE', '')
+VIDEO_QUERY_SAMPLE_RATE = 0.0
+
+# Background jobs, stored in the database and run by `manage.py run_worker`.
+# A running job whose lease isn't renewed within its visibility timeout is
+# handed to another worker; failures retry with exponential backoff.
+VIDEO_JOB_WORKERS = 2  # worker processes per run_worker
+VIDEO_JOB_MODULES = ['videos.tasks']
+VIDEO_JOB_POLL_INTERVAL = 1.0  # seconds
+VIDEO_JOB_VISIBILITY_TIMEOUT = 5 * 60
+VIDEO_JOB_MAX_ATTEMPTS = 5
+VIDEO_JOB_RETRY_BACKOFF = 30  # seconds before the first retry, doubling each time
+VIDEO_JOB_RETRY_BACKOFF_MAX = 60 * 60
+VIDEO_JOB_RETENTION_DAYS = 7  # finished jobs are pruned after this
+# Task name -> seconds between runs, queued by the workers
+VIDEO_PERIODIC_JOBS = {
+    'compute_related': 6 * 60 * 60,
+    'clear_stale_uploads': 60 * 60,
+    'prune_jobs': 24 * 60 * 60,
+    'gc_media': 24 * 60 * 60,
+}
+# Seconds a released file or deleted video's directories are kept before
+# their deletion job runs
+VIDEO_MEDIA_DELETE_DELAY = 5 * 60
+# Media garbage collection (gc_media): only files older than the grace
+# period are candidates, so uploads in progress are never taken for orphans
+VIDEO_GC_GRACE_HOURS = 24
+VIDEO_GC_WORKERS = 4  # directories scanned in parallel
+
+# Media Processing Settings
+# HLS adaptive-bitrate ladder: (name, height, video bitrate in kbps).
+# Rungs taller than the source are skipped.
+VIDEO_HLS_ENABLED = True
+VIDEO_HLS_LADDER = [
+    ('1080p', 1080, 5000),
+    ('720p', 720, 2800),
+    ('480p', 480, 1400),
+    ('360p', 360, 800),
+]
+VIDEO_HLS_SEGMENT_SECONDS = 6
+VIDEO_HLS_CACHE_SECONDS = 24 * 60 * 60
+# Poster, card thumbnails and seek-preview sprite. Files are named by content
+# hash and served with VIDEO_ARTWORK_CACHE_SECONDS of immutable caching.
+VIDEO_ARTWORK_ENABLED = True
+VIDEO_POSTER_POSITION = 0.1  # fraction of the duration a poster frame is taken at
+VIDEO_POSTER_WIDTH = 1280
+VIDEO_THUMBNAIL_WIDTHS = [320, 480, 640]  # 16:9 card sizes, WebP and JPEG
+VIDEO_SPRITE_INTERVAL = 5  # seconds between preview frames, at least
+VIDEO_SPRITE_MAX_TILES = 100
+VIDEO_SPRITE_TILE_WIDTH = 160
+VIDEO_SPRITE_COLUMNS = 10
+VIDEO_ARTWORK_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+# Cache Configuration
+# Local testing works with the default locmem backend or a shared file cache:
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# CACHE_LOCATION=/var/tmp/videostream-cache
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'videostream'),
+    },
+    # State every worker process must agree on, such as which viewers were
+    # already counted and how much pacing burst a client has left. Use Redis or Memcached when running several processes:
+    # SHARED_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+    # SHARED_CACHE_LOCATION=redis://127.0.0.1:6379/1
+    'shared': {
+        'BACKEND': os.environ.get('SHARED_CACHE_BACKEND',
+                                  os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', os.environ.get('CACHE_LOCATION', 'videostream-shared')),
+    },
+}
+
+# Ad beacons (videos.monetization_views): ad and campaign rates are cached
+# for VIDEO_AD_CACHE_TTL seconds, and a batch is limited to
+# VIDEO_AD_EVENTS_MAX_BATCH events
+VIDEO_AD_CACHE_ALIAS = 'default'
+VIDEO_AD_CACHE_TTL = 60
+VIDEO_AD_EVENTS_MAX_BATCH = 200
+# A viewer earns a creator revenue for an ad at most once per window; the
+# marks are kept in VIDEO_AD_CREDIT_CACHE so every worker sees them
+VIDEO_AD_CREDIT_CACHE = 'shared'
+VIDEO_AD_CREDIT_WINDOW = 30 * 60  # seconds
+
+# Whole pages for anonymous visitors and template fragments (video grid,
+# comments, related videos) are cached under versioned keys; 0 disables.
+VIDEO_PAGE_CACHE_ALIAS = 'default'
+VIDEO_PAGE_CACHE_TTL = 60
+VIDEO_FRAGMENT_CACHE_TTL = 300
 
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [